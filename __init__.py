@@ -17,6 +17,13 @@ if "bpy" in locals():
     importlib.reload(util)
     importlib.reload(edgeloop)
     importlib.reload(interpolate)
+    importlib.reload(arclength)
+    importlib.reload(schedule)
+    importlib.reload(flow)
+    importlib.reload(graph)
+    importlib.reload(landmarks)
+    importlib.reload(dijkstra)
+    importlib.reload(topology)
     importlib.reload(op_set_edge_flow)
     importlib.reload(op_set_edge_linear)
     importlib.reload(op_set_edge_curve)
@@ -25,6 +32,13 @@ else:
     from . import (
         util,
         interpolate,
+        schedule,
+        flow,
+        arclength,
+        graph,
+        landmarks,
+        dijkstra,
+        topology,
         edgeloop,
         op_set_edge_flow,
         op_set_edge_linear,
@@ -36,7 +50,7 @@ else:
 
 import bpy
 from bpy.types import Menu
-from bpy.props import BoolProperty, EnumProperty
+from bpy.props import BoolProperty, EnumProperty, IntProperty
 
 
 def menu_func_edges(self, context):
@@ -78,6 +92,7 @@ class Preferences(bpy.types.AddonPreferences):
 
     add_to_rightclick_menu: BoolProperty(name="Extend rightlick menu", default=True, update=on_preferences_update)
     list_insertion_choice: EnumProperty(name="Add at", items=list_insertion_options, default=2, update=on_preferences_update)
+    flow_workers: IntProperty(name="Set Flow Workers", default=1, min=1, soft_max=16, description="Independent parts of a large selection are spread over this many threads, or processes for very large selections. 1 runs Set Flow on the main thread only. Only used without tolerance and acceleration")
     
     def draw(self, context):
         layout = self.layout
@@ -93,6 +108,9 @@ class Preferences(bpy.types.AddonPreferences):
         row.prop(self, "list_insertion_choice")
         row.enabled = self.add_to_rightclick_menu
 
+        layout.label(text="Performance")
+        layout.prop(self, "flow_workers")
+
 class VIEW3D_MT_edit_mesh_set_flow(Menu):
     bl_label = "Set Flow"
 
@@ -0,0 +1,137 @@
+import math
+
+import numpy as np
+
+
+def flatten(evaluate, count, tolerance, initial=4, max_depth=20):
+    '''
+    Turns count parametric curves into polylines which stay within tolerance of the curves.
+    evaluate(curves, t) gives the points of the curves with the given indices at parameters t in [0, 1].
+
+    Every interval whose midpoint is further than tolerance from the middle of its chord is split,
+    all curves are refined together one level at a time. Flat parts therefore only get a few samples,
+    while tight bends get as many as they need.
+
+    Returns a list with a (M,3) point array for every curve.
+    '''
+    tolerance = max(tolerance, 1e-9)
+
+    curves = np.repeat(np.arange(count), initial)
+    steps = np.tile(np.arange(initial), count)
+    t0 = steps / float(initial)
+    t1 = (steps + 1) / float(initial)
+    p0 = evaluate(curves, t0)
+    p1 = evaluate(curves, t1)
+
+    done = []
+    for depth in range(max_depth + 1):
+        if len(curves) == 0:
+            break
+
+        mid = (t0 + t1) * 0.5
+        pm = evaluate(curves, mid)
+        error = np.linalg.norm(pm - (p0 + p1) * 0.5, axis=1)
+
+        split = error > tolerance
+        if depth == max_depth:
+            split[:] = False
+
+        keep = ~split
+        done.append((curves[keep], t0[keep], p0[keep], p1[keep]))
+
+        curves = np.repeat(curves[split], 2)
+        t0 = np.stack((t0[split], mid[split]), axis=1).ravel()
+        t1 = np.stack((mid[split], t1[split]), axis=1).ravel()
+        p0, p1 = (
+            np.stack((p0[split], pm[split]), axis=1).reshape(-1, 3),
+            np.stack((pm[split], p1[split]), axis=1).reshape(-1, 3),
+        )
+
+    curves, t0, p0, p1 = (np.concatenate(parts) for parts in zip(*done))
+    order = np.lexsort((t0, curves))
+    curves, p0, p1 = curves[order], p0[order], p1[order]
+
+    ends = np.searchsorted(curves, np.arange(count + 1))
+    polylines = []
+    for index in range(count):
+        start, end = ends[index], ends[index + 1]
+        polylines.append(np.concatenate((p0[start:end], p1[end - 1:end])))
+
+    return polylines
+
+
+def spline(controls, basis):
+    '''
+    Evaluation function for flatten, controls: (N,4,3) control points, basis(t): (K,4) weights.
+    '''
+    controls = np.asarray(controls, dtype=np.float64)
+
+    def evaluate(curves, t):
+        return np.einsum('kj,kjd->kd', basis(t), controls[curves])
+
+    return evaluate
+
+
+def join(polylines):
+    '''
+    Chains polylines into one, the shared end and start points are only kept once.
+    '''
+    parts = [polylines[0]] + [polyline[1:] for polyline in polylines[1:]]
+    return np.concatenate(parts)
+
+
+def resample(points, offsets, counts):
+    '''
+    Places counts[i] points evenly by arc length on every polyline points[offsets[i]:offsets[i+1]].
+    All polylines are handled in one go: the cumulative length is taken over all points,
+    each target length is found with a binary search and interpolated inside its chord.
+    Polylines need at least two points, the first and last point are part of the result.
+
+    Returns a (sum(counts),3) array.
+    '''
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    counts = np.asarray(counts, dtype=np.int64)
+
+    lengths = np.linalg.norm(np.diff(points, axis=0), axis=1)
+    # no length between the end of one polyline and the start of the next
+    lengths[offsets[1:-1] - 1] = 0.0
+    cumulative = np.concatenate(([0.0], np.cumsum(lengths)))
+
+    starts = cumulative[offsets[:-1]]
+    totals = cumulative[offsets[1:] - 1] - starts
+
+    polyline = np.repeat(np.arange(len(counts)), counts)
+    steps = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    fractions = steps / np.maximum(counts - 1, 1)[polyline].astype(np.float64)
+    targets = starts[polyline] + totals[polyline] * fractions
+
+    index = np.searchsorted(cumulative, targets, side='right') - 1
+    index = np.clip(index, offsets[:-1][polyline], offsets[1:][polyline] - 2)
+
+    chord = lengths[index]
+    factor = np.divide(targets - cumulative[index], chord, out=np.zeros_like(chord), where=chord > 0.0)
+    factor = np.clip(factor, 0.0, 1.0)[:, np.newaxis]
+
+    return points[index] + (points[index + 1] - points[index]) * factor
+
+
+def resample_polylines(polylines, counts):
+    '''
+    resample for a list of polylines, returns one position array per polyline.
+    '''
+    sizes = [len(polyline) for polyline in polylines]
+    offsets = np.concatenate(([0], np.cumsum(sizes)))
+    positions = resample(np.concatenate(polylines), offsets, counts)
+    return np.split(positions, np.cumsum(counts)[:-1])
+
+
+def arc_samples(radius, angle, tolerance):
+    '''
+    Number of evenly spaced samples of a circle arc which keeps every chord within tolerance of the arc.
+    '''
+    if radius <= tolerance:
+        return 2
+
+    step = 2.0 * math.acos(1.0 - tolerance / radius)
+    return max(int(math.ceil(abs(angle) / step)), 1) + 1
@@ -0,0 +1,320 @@
+'''
+Measurements for the Set Flow solvers, meant to be run from the python console in edit mode:
+
+    from EdgeFlow import benchmark
+    benchmark.flow_passes(C)
+    benchmark.steady_state()
+    benchmark.loop_memory(C)
+    benchmark.walker_scaling()
+    benchmark.compare_straighten()
+    benchmark.loop_lookup(C)
+    benchmark.flow_threads(C)
+
+Nothing here changes the mesh.
+'''
+import math
+import sys
+import time
+
+import bmesh
+import mathutils
+import numpy as np
+
+from . import edgeloop
+from . import flow
+from . import topology
+from . import util
+
+
+def compare_solvers(system, tension=1.8, min_angle=0.0, tolerance=1e-5, iterations=1000):
+    '''
+    Runs every solver and acceleration of a flow.FlowSystem from the same start positions.
+    Returns one row per combination: solver, acceleration, passes, last residual, evaluated rows, seconds
+    and the largest distance of a vert to the result of the plain sequential run, which should stay near the tolerance.
+    '''
+    initial = system.co.copy()
+
+    rows = []
+    sequential = None
+    for solver, _, _ in flow.solvers:
+        for acceleration, _, _ in flow.accelerations:
+            system.co = initial.copy()
+
+            start = time.perf_counter()
+            residuals = system.set_flow(tension, min_angle, iterations, solver, tolerance, acceleration=acceleration)
+            seconds = time.perf_counter() - start
+
+            if sequential is None:
+                sequential = system.co.copy()
+            difference = float(np.abs(system.co - sequential).max()) if len(sequential) else 0.0
+
+            rows.append((solver, acceleration, len(residuals), residuals[-1] if residuals else 0.0,
+                         system.evaluations, seconds, difference))
+
+    system.co = initial
+    return rows
+
+
+def print_rows(header, rows):
+    print(" | ".join("%12s" % h for h in header))
+    for row in rows:
+        print(" | ".join("%12.6f" % v if isinstance(v, float) else "%12s" % (v,) for v in row))
+
+
+def selected_loops(obj):
+    bm = bmesh.from_edit_mesh(obj.data)
+    bm.verts.ensure_lookup_table()
+    edges = [e for e in bm.edges if e.select]
+    return bm, util.get_edgeloops(bm, edges)
+
+
+def flow_passes(context, tension=1.8, min_angle=0.0, tolerance=1e-5, iterations=1000):
+    '''
+    Passes needed to reach the tolerance on the selected edgeloops of the active object, for all solvers.
+    '''
+    bm, loops = selected_loops(context.object)
+    system = flow.FlowSystem(bm, loops)
+
+    rows = compare_solvers(system, tension, min_angle, tolerance, iterations)
+    print("Set Flow: %s loops, %s verts, tolerance %s" % (len(loops), len(system.moved), tolerance))
+    print_rows(("solver", "acceleration", "passes", "residual", "evaluations", "seconds", "difference"), rows)
+    return rows
+
+
+def steady_state(size=12, iterations=64, tension=1.8):
+    '''
+    Runs all solvers for a fixed number of iterations on a wavy temporary grid, once on parallel loops
+    and once on all edges of a patch, where every vert is moved by a row and a column loop.
+    The difference column compares with as many sequential passes, it should be about the last residual.
+    '''
+    bm = bmesh.new()
+    bmesh.ops.create_grid(bm, x_segments=size, y_segments=size, size=1.0)
+    for vert in bm.verts:
+        x, y, z = vert.co
+        vert.co = (x, y, math.sin(x * 3.0) * math.cos(y * 2.0) * 0.3)
+
+    def inside(edge, low, high):
+        return all(low <= vert.co.x <= high and low <= vert.co.y <= high for vert in edge.verts)
+
+    def along_x(edge):
+        return abs(edge.verts[0].co.y - edge.verts[1].co.y) < 1e-6
+
+    selections = (
+        ("parallel", [e for e in bm.edges if along_x(e) and inside(e, -1.0, 1.0) and abs(e.verts[0].co.y) < 0.3]),
+        ("crossing", [e for e in bm.edges if inside(e, -0.5, 0.4)]),
+    )
+
+    rows = []
+    for name, edges in selections:
+        system = flow.FlowSystem(bm, util.get_edgeloops(bm, edges))
+        for row in compare_solvers(system, tension, 0.0, 0.0, iterations):
+            rows.append((name,) + row)
+    bm.free()
+
+    print("Set Flow: %s iterations on a %s x %s grid" % (iterations, size, size))
+    print_rows(("selection", "solver", "acceleration", "passes", "residual", "evaluations", "seconds", "difference"), rows)
+    return rows
+
+
+def python_loop_bytes(loops):
+    '''
+    Rough size of the python containers of edgeloop.Loop objects, the bmesh elements themselves are not counted.
+    Edge rings are shared between loops and only counted once.
+    '''
+    size = 0
+    rings = set()
+    for loop in loops:
+        size += sys.getsizeof(loop)
+        size += sys.getsizeof(loop.verts) + sys.getsizeof(loop.edges)
+        size += sys.getsizeof(loop.valences) + sum(sys.getsizeof(v) for v in loop.valences)
+        size += sys.getsizeof(loop.ring) + sum(sys.getsizeof(r) for r in loop.ring.values())
+        size += sys.getsizeof(loop.edge_rings) + sys.getsizeof(loop.ends)
+        for edge, ring in loop.edge_rings.items():
+            if id(ring) not in rings:
+                rings.add(id(ring))
+                size += sys.getsizeof(ring) + sys.getsizeof(loop.ends[edge])
+    return size
+
+
+def loop_memory(context):
+    '''
+    Memory of the selected edgeloops of the active object per thousand loops,
+    as edgeloop.Loop objects and as an edgeloop.LoopSet.
+    '''
+    bm, loops = selected_loops(context.object)
+    loop_set = edgeloop.LoopSet(bm, loops)
+
+    thousands = max(len(loops), 1) / 1000.0
+    rows = [
+        ("Loop", int(python_loop_bytes(loops) / thousands)),
+        ("LoopSet", loop_set.bytes_per_thousand_loops()),
+    ]
+    print("Loops: %s loops, %s verts" % (len(loops), len(loop_set.verts)))
+    print_rows(("container", "bytes/1000"), rows)
+    return rows
+
+
+def walker_scaling(sizes=(1000, 2000, 4000, 8000, 16000)):
+    '''
+    Times the util walkers on loops of growing length in a temporary bmesh.
+    The microseconds per edge should stay flat, growing numbers mean a walker is no longer linear.
+    '''
+    rows = []
+    for size in sizes:
+        bm = bmesh.new()
+        bmesh.ops.create_grid(bm, x_segments=size, y_segments=2, size=1.0)
+        bmesh.ops.create_circle(bm, cap_ends=True, segments=size, radius=1.0)
+        bm.edges.ensure_lookup_table()
+
+        boundary = next(e for e in bm.edges if e.is_boundary and all(len(v.link_edges) == 3 for v in e.verts))
+        inner = next(e for e in bm.edges if all(len(v.link_edges) == 4 for v in e.verts))
+        ngon = next(e for e in bm.edges if any(len(f.verts) > 4 for f in e.link_faces))
+
+        row = [size]
+        for walk, edge in ((util.walk_boundary, boundary), (util.walk_edge_loop, inner), (util.walk_ngon, ngon)):
+            start = time.perf_counter()
+            edges = walk(edge)
+            row.append(len(edges))
+            row.append((time.perf_counter() - start) * 1e6 / len(edges))
+        rows.append(tuple(row))
+        bm.free()
+
+    print_rows(("size", "boundary", "us/edge", "edge loop", "us/edge", "ngon", "us/edge"), rows)
+    return rows
+
+
+def straighten_edge(edge, distance):
+    '''
+    Reference for LoopSet.straighten on one edge, places the end points of the edge evenly distanced
+    to the 'next' verts in the extension of the edge loop.
+
+    Moves A and B:
+
+    A' ------ A - B -- B'
+
+    to:
+
+    A' --- A --- B --- B'
+    '''
+    def find_neighbour(p):
+        edges = set(p.link_edges)
+        edges.remove(edge)
+        for face in edge.link_faces[:1] if edge.is_boundary else edge.link_faces[:2]:
+            if len(face.verts) == 4:
+                edges -= set(face.edges)
+
+        v = mathutils.Vector((0, 0, 0))
+        for e in edges:
+            v += e.other_vert(p).co
+        if edges:
+            v /= len(edges)
+        return v
+
+    a1, a2 = edge.verts
+    if len(a1.link_edges) <= 3 or len(a2.link_edges) <= 3:
+        return
+
+    b1 = find_neighbour(a1)
+    b2 = find_neighbour(a2)
+
+    direction = (b2 - b1).normalized()
+    distance = min(distance, (b2 - b1).length * 0.5)
+
+    a1.co = b1 + distance * direction
+    a2.co = b2 - distance * direction
+
+
+def compare_straighten(size=16, distance=0.05):
+    '''
+    Straightens spaced single edges of a wavy temporary grid with LoopSet.straighten and with
+    straighten_edge edge after edge. Returns the largest difference between both, it should be zero.
+    '''
+    bm = bmesh.new()
+    bmesh.ops.create_grid(bm, x_segments=size, y_segments=size, size=1.0)
+    for vert in bm.verts:
+        x, y, z = vert.co
+        vert.co = (x, y, math.sin(x * 7.0) * math.cos(y * 5.0) * 0.1)
+
+    # every third edge, as long as it doesn't touch one taken already
+    edges = []
+    used = set()
+    for edge in list(bm.edges)[::3]:
+        if not used.intersection(edge.verts):
+            used.update(edge.verts)
+            edges.append(edge)
+
+    loops = util.get_edgeloops(bm, edges)
+    initial = [vert.co.copy() for vert in bm.verts]
+
+    edgeloop.LoopSet(bm, loops).straighten(distance)
+    batched = [vert.co.copy() for vert in bm.verts]
+
+    for vert, co in zip(bm.verts, initial):
+        vert.co = co
+    for loop in loops:
+        if len(loop.edges) == 1:
+            straighten_edge(loop.edges[0], distance)
+
+    difference = max((vert.co - co).length for vert, co in zip(bm.verts, batched))
+    moved = max((vert.co - co).length for vert, co in zip(bm.verts, initial))
+    bm.free()
+
+    print("Straighten: %s edges, moved up to %.6f, difference %.3g" % (len(loops), moved, difference))
+    return difference
+
+
+def loop_lookup(context):
+    '''
+    Seconds to get the selected edgeloops of the active object by walking them,
+    to build a topology.LoopIndex of the whole mesh and to look them up in it.
+    '''
+    obj = context.object
+    bm = bmesh.from_edit_mesh(obj.data)
+    edges = [e for e in bm.edges if e.select]
+
+    start = time.perf_counter()
+    loops = util.get_edgeloops(bm, edges)
+    walked = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index = topology.LoopIndex(bm, topology.topology_key(bm))
+    built = time.perf_counter() - start
+
+    start = time.perf_counter()
+    util.get_edgeloops(bm, edges, index)
+    looked_up = time.perf_counter() - start
+
+    rows = [("walk", walked), ("build", built), ("lookup", looked_up)]
+    print("Loops: %s loops, %s indexed loops, index %s bytes" % (len(loops), len(index), index.nbytes()))
+    print_rows(("method", "seconds"), rows)
+    return rows
+
+
+def flow_threads(context, workers=(1, 2, 4, 8), tension=1.8, iterations=64, solver="SEQUENTIAL", processes=False):
+    '''
+    Seconds Set Flow takes on the selected edgeloops of the active object with growing worker pools.
+    The speedup column compares with a single thread, the reported one with the components one after another.
+    processes: use worker processes whatever the size of the selection.
+    '''
+    bm, loops = selected_loops(context.object)
+    system = flow.FlowSystem(bm, loops)
+    if processes:
+        system.min_process_rows = 0
+    initial = system.co.copy()
+
+    # the first parallel run also measures the single thread baseline of the reported speedup
+    system.set_flow(tension, 0.0, iterations, solver, workers=max(workers))
+
+    rows = []
+    for count in workers:
+        system.co = initial.copy()
+        start = time.perf_counter()
+        system.set_flow(tension, 0.0, iterations, solver, workers=count)
+        seconds = time.perf_counter() - start
+        rows.append((count, system.pool or "", system.parallel_parts, seconds,
+                     rows[0][3] / seconds if rows else 1.0, system.speedup))
+
+    system.co = initial
+    print("Set Flow: %s loops, %s components, %s rows" % (len(loops), len(system.schedule.components), system.rows()))
+    print_rows(("workers", "pool", "parts", "seconds", "speedup", "reported"), rows)
+    return rows
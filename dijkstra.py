@@ -1,49 +1,385 @@
+import functools
+import heapq
+import itertools
 import math
+from array import array
+
+
+class SearchStats():
+    '''
+    Counts the work done by the path searches, pass one into find_path to compare the search modes.
+    '''
+    def __init__(self):
+        self.searches = 0
+        self.expanded = 0
+
+    def __str__(self):
+        return "searches: %s - expanded verts: %s" % (self.searches, self.expanded)
+
+
+class _SearchState():
+    '''
+    Per vert buffers shared by consecutive searches on the same graph, one set per search direction.
+    A vert only counts as reached when its stamp matches the current search,
+    so nothing needs to be cleared between searches.
+    '''
+    def __init__(self, vert_count):
+        self.vert_count = vert_count
+        self.search = 0
+        self.sides = [None, None]
+
+    def begin(self):
+        self.search += 1
+        return self.search
+
+    def side(self, index):
+        if self.sides[index] is None:
+            count = self.vert_count
+            reached = array('i', bytes(4 * count))
+            parents = array('i', bytes(4 * count))
+            lengths = array('d', bytes(8 * count))
+            self.sides[index] = (reached, parents, lengths)
+        return self.sides[index]
 
 
 # https://blender.stackexchange.com/questions/186067/what-is-the-bmesh-equivalent-to-bpy-ops-mesh-shortest-path-select
-class _Node:
-    @property
-    def edges(self):
-        return (e for e in self.vert.link_edges if not e.tag)
+def find_path(graph, start, target, use_topology_distance=False, goal_directed=True, bound=None, stats=None, landmarks=None):
+    '''
+    Finds the shortest path between two vert indices of a graph.VertGraph.
+    Returns the vert indices leading from start to target, empty if the verts are not connected.
+
+    goal_directed: A* towards the target for edge lengths, a bidirectional search for topology distance.
+    bound: Limits the search to an ellipsoid around both verts, its size is a factor of their distance.
+           If nothing is found inside, the search is repeated without the bound.
+    landmarks: Optional landmarks.LandmarkIndex, goal directed searches then use A* with its lower bounds in both modes.
+    '''
+    state = _SearchState(graph.vert_count)
+    return _find_path(graph, state, start, target, use_topology_distance, goal_directed, bound, stats, landmarks)
+
+
+def find_paths(graph, knots, use_topology_distance=False, goal_directed=True, bound=None, stats=None, shortcut=None, landmarks=None):
+    '''
+    Solves the paths between all consecutive knots in one go, the search buffers are shared by all pairs.
+    [a,b,c] -> path a..b..c
+
+    shortcut: Optional function(start, target) which may return a known path for a pair.
+              It is only taken if it is no longer than the searched path, in edge lengths the search
+              is then bounded by the length of the shortcut.
+
+    Returns the joined vert path and the position of every knot inside of it.
+    Verts which are already part of the path are not added a second time.
+    If two knots are not connected, the path ends at the last reached knot.
+    '''
+    if not knots:
+        return [], []
+
+    state = _SearchState(graph.vert_count)
+
+    vert_path = [knots[0]]
+    boundaries = [0]
+    positions = {knots[0]: 0}
+
+    for start, target in zip(knots, knots[1:]):
+        known = shortcut(start, target) if shortcut is not None else None
+        pair_bound = bound
+        if known is not None and not use_topology_distance:
+            pair_bound = _length_bound(graph, known, bound)
+
+        path = _find_path(graph, state, start, target, use_topology_distance, goal_directed, pair_bound, stats, landmarks)
+        if known is not None and (not path or _path_length(graph, known, use_topology_distance) <=
+                                  _path_length(graph, path, use_topology_distance) * (1.0 + 1e-9)):
+            path = known
+        if not path:
+            break
+
+        for v in path:
+            if v not in positions:
+                positions[v] = len(vert_path)
+                vert_path.append(v)
+
+        boundaries.append(positions[target])
+
+    return vert_path, boundaries
+
+
+def find_chain(graph, verts, knots):
+    '''
+    Orders verts which already form a single open chain running from the first to the last knot.
+    Returns the ordered chain and the knot positions inside of it,
+    None if the verts are no such chain or the knots are not passed in their order.
+    '''
+    if len(knots) < 2 or len(verts) < 2:
+        return None
+
+    offsets, neighbours = graph.views()[:2]
+    members = set(verts)
+    if not members.issuperset(knots):
+        return None
+
+    links = {}
+    for vert in members:
+        linked = [neighbours[i] for i in range(offsets[vert], offsets[vert + 1]) if neighbours[i] in members]
+        if len(linked) > 2:
+            return None
+        links[vert] = linked
+
+    start, end = knots[0], knots[-1]
+    if len(links[start]) != 1 or len(links[end]) != 1:
+        return None
+
+    chain = [start]
+    previous, vert = -1, start
+    while vert != end:
+        following = [v for v in links[vert] if v != previous]
+        if len(following) != 1:
+            return None
+        previous, vert = vert, following[0]
+        chain.append(vert)
+
+    if len(chain) != len(members):
+        return None
+
+    positions = {v: i for i, v in enumerate(chain)}
+    boundaries = [positions[k] for k in knots]
+    if any(a >= b for a, b in zip(boundaries, boundaries[1:])):
+        return None
+
+    return chain, boundaries
+
+
+def _find_path(graph, state, start, target, use_topology_distance, goal_directed, bound, stats, landmarks=None):
+    if stats is None:
+        stats = SearchStats()
+
+    admit = None
+    if bound is not None:
+        admit = _ellipsoid(graph, start, target, bound)
+
+    if not goal_directed:
+        search = _breadth_first if use_topology_distance else _dijkstra
+    elif landmarks is not None:
+        search = functools.partial(_astar_landmarks, landmarks=landmarks, unit_length=use_topology_distance)
+    else:
+        search = _bidirectional if use_topology_distance else _astar
+
+    path = search(graph, state, start, target, admit, stats)
+    if not path and admit is not None:
+        path = search(graph, state, start, target, None, stats)
+
+    return path
+
+
+def _path_length(graph, path, use_topology_distance):
+    if use_topology_distance:
+        return len(path) - 1
+
+    co = graph.views()[3]
+    return sum(math.dist(co[a * 3:a * 3 + 3], co[b * 3:b * 3 + 3]) for a, b in zip(path, path[1:]))
+
+
+def _length_bound(graph, path, bound):
+    '''
+    The bound factor whose ellipsoid holds every path no longer than the given one.
+    '''
+    co = graph.views()[3]
+    start, target = path[0], path[-1]
+    distance = math.dist(co[start * 3:start * 3 + 3], co[target * 3:target * 3 + 3])
+    if distance == 0.0:
+        return bound
+
+    factor = _path_length(graph, path, False) * (1.0 + 1e-9) / distance
+    return factor if bound is None else min(factor, max(bound, 1.0))
+
+
+def _ellipsoid(graph, start, target, bound):
+    co = graph.views()[3]
+    a = co[start * 3:start * 3 + 3]
+    b = co[target * 3:target * 3 + 3]
+    limit = math.dist(a, b) * max(bound, 1.0)
+
+    def admit(v):
+        p = co[v * 3:v * 3 + 3]
+        return math.dist(p, a) + math.dist(p, b) <= limit
+
+    return admit
+
+
+def _straight_distance(graph, target):
+    co = graph.views()[3]
+    target_co = co[target * 3:target * 3 + 3]
+
+    def estimate(v):
+        return math.dist(co[v * 3:v * 3 + 3], target_co)
+
+    return estimate
+
+
+def _dijkstra(graph, state, start, target, admit, stats):
+    return _search(graph, state, start, target, admit, stats, None)
+
+
+def _astar(graph, state, start, target, admit, stats):
+    '''
+    The straight distance to the target never overestimates an edge path.
+    '''
+    return _search(graph, state, start, target, admit, stats, _straight_distance(graph, target))
+
+
+def _astar_landmarks(graph, state, start, target, admit, stats, landmarks, unit_length):
+    '''
+    Lower bounds from the landmark distances, for edge lengths combined with the straight distance.
+    '''
+    landmark_estimate = landmarks.estimator(target)
+    if unit_length:
+        estimate = landmark_estimate
+    else:
+        straight_estimate = _straight_distance(graph, target)
+
+        def estimate(v):
+            return max(straight_estimate(v), landmark_estimate(v))
+
+    return _search(graph, state, start, target, admit, stats, estimate, unit_length)
+
+
+def _search(graph, state, start, target, admit, stats, estimate, unit_length=False):
+    '''
+    Binary heap with lazy deletion, an entry is stale once a shorter length to its vert was found.
+    The counter keeps verts with equal estimates in insertion order.
+    Verts can be reopened, so estimates only have to be lower bounds to find the shortest path.
+    '''
+    stats.searches += 1
+
+    offsets, neighbours, edge_length = graph.views()[:3]
+
+    search = state.begin()
+    reached, parents, lengths = state.side(0)
+
+    reached[start] = search
+    parents[start] = -1
+    lengths[start] = 0.0
+
+    counter = itertools.count()
+    heap = [(estimate(start) if estimate else 0.0, next(counter), 0.0, start)]
+    while heap:
+        _, _, length, vert = heapq.heappop(heap)
+        if length > lengths[vert]:
+            continue
+        stats.expanded += 1
+
+        if vert == target:
+            break
+
+        for i in range(offsets[vert], offsets[vert + 1]):
+            v = neighbours[i]
+            if admit is not None and not admit(v):
+                continue
+
+            new_length = length + (1.0 if unit_length else edge_length[i])
+            if reached[v] != search or new_length < lengths[v]:
+                reached[v] = search
+                lengths[v] = new_length
+                parents[v] = vert
+                priority = new_length + estimate(v) if estimate else new_length
+                heapq.heappush(heap, (priority, next(counter), new_length, v))
+
+    return _trace_path(state, 0, search, target)
+
+
+def _breadth_first(graph, state, start, target, admit, stats):
+    stats.searches += 1
+
+    offsets, neighbours = graph.views()[:2]
+
+    search = state.begin()
+    reached, parents, _ = state.side(0)
+
+    reached[start] = search
+    parents[start] = -1
+
+    visiting = [start]
+    for vert in visiting:
+        stats.expanded += 1
+
+        if vert == target:
+            break
+
+        for i in range(offsets[vert], offsets[vert + 1]):
+            v = neighbours[i]
+            if reached[v] != search and (admit is None or admit(v)):
+                reached[v] = search
+                parents[v] = vert
+                visiting.append(v)
+
+    return _trace_path(state, 0, search, target)
+
+
+def _bidirectional(graph, state, start, target, admit, stats):
+    '''
+    Grows a breadth first search from both verts, always one whole level of the smaller frontier.
+    The level which touches the other side holds all meeting points of the shortest length.
+    '''
+    stats.searches += 1
+
+    if start == target:
+        return [start]
 
-    def __init__(self, v):
-        self.vert = v
-        self.length = math.inf
-        self.shortest_path = []
+    offsets, neighbours = graph.views()[:2]
 
+    search = state.begin()
+    frontiers = [[start], [target]]
+    for side, root in enumerate((start, target)):
+        reached, parents, depths = state.side(side)
+        reached[root] = search
+        parents[root] = -1
+        depths[root] = 0
 
-def find_path(bm, v_start, v_target=None, use_topology_distance=False):
-    for e in bm.edges:
-        e.tag = False
+    while frontiers[0] and frontiers[1]:
+        side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+        reached, parents, depths = state.side(side)
+        other_reached, _, other_depths = state.side(1 - side)
 
-    d = {v: _Node(v) for v in bm.verts}
-    node = d[v_start]
-    node.length = 0
+        best = None
+        next_frontier = []
+        for vert in frontiers[side]:
+            stats.expanded += 1
+            depth = depths[vert] + 1
 
-    visiting = [node]
+            for i in range(offsets[vert], offsets[vert + 1]):
+                v = neighbours[i]
+                if other_reached[v] == search:
+                    length = depth + other_depths[v]
+                    if best is None or length < best[0]:
+                        best = (length, vert, v)
+                if reached[v] != search and (admit is None or admit(v)):
+                    reached[v] = search
+                    parents[v] = vert
+                    depths[v] = depth
+                    next_frontier.append(v)
 
-    while visiting:
-        node = visiting.pop(0)
+        frontiers[side] = next_frontier
 
-        if node.vert is v_target:
-            return d
+        if best is not None:
+            _, vert, v = best
+            near = _trace_path(state, side, search, vert)
+            far = _trace_path(state, 1 - side, search, v)
+            path = near + list(reversed(far))
+            if side == 1:
+                path.reverse()
+            return path
 
-        for e in node.edges:
-            e.tag = True
+    return []
 
-            if use_topology_distance:
-                length = node.length + 1
-            else:
-                length = node.length + e.calc_length()
-            v = e.other_vert(node.vert)
 
-            visit = d[v]
-            visiting.append(visit)
-            if visit.length > length:
-                visit.length = length
-                visit.shortest_path = node.shortest_path + [e]
+def _trace_path(state, side, search, target):
+    reached, parents, _ = state.side(side)
+    if reached[target] != search:
+        return []
 
-        visiting.sort(key=lambda n: n.length)
+    path = []
+    vert = target
+    while vert != -1:
+        path.append(vert)
+        vert = parents[vert]
 
-    return d
+    path.reverse()
+    return path
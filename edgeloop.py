@@ -1,13 +1,17 @@
 import bpy
 import bmesh
-import math
-import mathutils
+import numpy as np
 
 from . import interpolate
+from . import arclength
+from . import flow
+from . import kernels
 
-from .op_set_vertex_curve  import map_segment_onto_spline 
 
 class Loop():
+    __slots__ = ("bm", "edges", "verts", "is_cyclic", "valences", "max_valence",
+                 "ring", "edge_rings", "ends")
+
     def __init__(self, bm, edges):
         self.bm = bm
         self.edges = edges
@@ -33,11 +37,6 @@ class Loop():
             self.verts.reverse()
             self.edges.reverse()
 
-        #store intial vertex coordinates      
-        self.initial_vert_positions = []
-        for i, v in enumerate(self.verts):
-            self.initial_vert_positions.append(v.co.copy())
-
         self.is_cyclic = self.verts[0] == self.verts[-1]
         
         # print("edgeloop length: %s" % len(self.edges))
@@ -96,429 +95,446 @@ class Loop():
         ring = self.edge_rings[edge]
         return (ring[0], ring[len(ring) - 1])
 
-    def set_curve_flow(self, tension, use_rail, rail_type, rail_start, rail_end):
-        count = len(self.edges)
-        if count < 2 or self.is_cyclic:
-            return
 
-        self.bm.verts.ensure_lookup_table()
-        self.bm.edges.ensure_lookup_table()
-
-        start_vert, end_vert = None, None
-        #get starting points
-        for p in self.edges[0].verts:
-            if p not in self.edges[1].verts:
-                start_vert = p
-
-        for p in self.edges[-1].verts:
-            if p not in self.edges[-2].verts:
-                end_vert = p
-
-        def print_bm_loop(corner):
-            '''
-            Vert -> head -- Edge -> Tail
-            link_loop_prev => where head points to
-            '''
-            def get_string(corner):
-                return  f"{corner.index} | vert: {corner.vert.index} edge: {corner.edge.index}"
-
-            print("----------------------------")
-            l = corner
-            print("corner:              ", get_string(l))
-            l = corner.link_loop_next
-            print("link_loop_next       ", get_string(l))
-            l = corner.link_loop_prev
-            print("link_loop_prev       ", get_string(l))
-            l = corner.link_loop_radial_next
-            print("link_loop_radial_next", get_string(l))
-            l = corner.link_loop_radial_prev
-            print("link_loop_radial_prev", get_string(l))
-            print("----------------------------")
-
-        def find_direction(point, edge):   
-            if len(point.link_edges) == 2:    
-                # |_ corner case with mesh borders            
-                a = point.link_edges[0].other_vert(point).co - point.co
-                b = point.link_edges[1].other_vert(point).co - point.co
-              
-                # if a is edge
-                if point.link_edges[0] == edge:
-                    c = a.cross(b)                    
-                    d = c.cross(b)
-                # if b is edge
-                else:
-                    c = b.cross(a)
-                    d = c.cross(a)
-                    
-                return -d.normalized()
-               
-            elif len(point.link_edges) == 3:  
-                # original_corner = point.link_loops[0]
-                # for corner in point.link_loops:              
-                #     if corner.vert == point and corner.edge == edge:
-                #         original_corner = corner
-                
-                # edge is at an 'end'
-                # _|_
-                if len(edge.link_faces) == 2:     
-                    a = edge.other_vert(point).co - point.co
-                    n = edge.link_loops[0].face.normal + edge.link_loops[1].face.normal
-                    n = n.normalized()
-                    c = a.cross(n)
-                    c = c.cross(-n)
-                    return c.normalized()               
-                else:
-                    # |_
-                    # |
-                    # search for the edge which is not neighbouring 
-                    # to the face connected to the input edge
-                    for e in point.link_edges:
-                        is_connected_to_end_edge = False
-                        for f in e.link_faces:
-                            if f in edge.link_faces:                                
-                                is_connected_to_end_edge = True
-                                break                     
-
-                        if not is_connected_to_end_edge: 
-                            b = e.other_vert(point)
-                            break
-
-                    a = point
-                    c = a.co - b.co
-                    return c.normalized()
-
-            elif len(point.link_edges) == 4:    
-                # regular quad case
-                # _|_
-                #  |  
-                for corner in edge.link_loops:
-                    if corner.vert == point:
-                        a = point
-                        b = corner.link_loop_prev.link_loop_radial_prev.link_loop_prev.vert
-                        c = a.co - b.co
-                        return c.normalized()                        
-            else:                
-                a = edge.other_vert(point).co - point.co
-                n = edge.link_loops[0].face.normal + edge.link_loops[1].face.normal
-                n = n.normalized()
-                c = a.cross(n)
-                c = c.cross(n)
-                return -c.normalized()         
-        
-        # if use_rail:
-        #     dir1 = self.edges[0].other_vert(start_vert).co - start_vert.co
-        #     dir1 = dir1.normalized()
-        #     dir2 = self.edges[-1].other_vert(end_vert).co - end_vert.co
-        #     dir2 = dir2.normalized()
-        # else:
-        #     dir1 = find_direction(start_vert, self.edges[0])
-        #     dir2 = find_direction(end_vert, self.edges[-1])
-        
-        dir1_unnormalized = self.edges[0].other_vert(start_vert).co - start_vert.co
-        dir1 = dir1_unnormalized.normalized()
-        dir2_unnormalized = self.edges[-1].other_vert(end_vert).co - end_vert.co
-        dir2 = dir2_unnormalized.normalized()
+class LoopSet():
+    '''
+    All edgeloops of a selection in flat arrays, so the operators can work on every loop at once.
+    The verts of loop i are verts[offsets[i]:offsets[i + 1]] in loop order, a cyclic loop repeats its first vert.
+    Every loop has one edge less than verts, its edges, valences and ring ids start at offsets[i] - i.
+    ring_ids tells which edge ring an edge belongs to, edges of the same ring share the id, edges without a ring get -1.
+    initial_co holds the positions of all loop verts when the set was built.
 
-        if use_rail:
-            if rail_type == 'ABSOLUTE':
-                p1 = start_vert.co + (dir1_unnormalized - dir1 * rail_start)
-                p4 = end_vert.co + (dir2_unnormalized - dir2 * rail_end)
-            else: # == 'FACTOR'
-                p1 = start_vert.co + dir1_unnormalized * rail_start
-                p4 = end_vert.co + dir2_unnormalized * rail_end
-        else:
-            p1 = start_vert.co
-            p4 = end_vert.co
+    Everything here is stored by index, so a set stays usable on a new bmesh of the same mesh,
+    like the one the redo panel hands over, see rebind.
+    '''
 
-        scale = (p1 - p4).length * 0.5
-        scale *= tension
-
-        p2 = p1 + (dir1 * scale)
-        p3 = p4 + (dir2 * scale)
-         
-        # add_debug_verts = False
-        # if add_debug_verts:
-        #    bmesh.ops.create_vert(self.bm, co=p1)
-        #    bmesh.ops.create_vert(self.bm, co=p4)
-        #    bmesh.ops.create_vert(self.bm, co=p2)
-        #    bmesh.ops.create_vert(self.bm, co=p3)
-       
-        spline_points = []
-        precision = 1000
-        spline_points = mathutils.geometry.interpolate_bezier(p1, p2, p3, p4, precision)
+    def __init__(self, bm, loops):
+        self.bm = bm
+        self.loops = loops
+
+        sizes = [len(loop.verts) for loop in loops]
+        self.offsets = np.zeros(len(loops) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=self.offsets[1:])
+        total = int(self.offsets[-1])
+
+        self.verts = np.fromiter((v.index for loop in loops for v in loop.verts), dtype=np.int32, count=total)
+        self.edges = np.fromiter((e.index for loop in loops for e in loop.edges), dtype=np.int32, count=total - len(loops))
+        self.valences = np.fromiter((valence for loop in loops for valence in loop.valences), dtype=np.int32, count=len(self.edges))
+        self.cyclic = np.fromiter((loop.is_cyclic for loop in loops), dtype=bool, count=len(loops))
+
+        rings = {}
+        ring_ids = []
+        for loop in loops:
+            for edge in loop.edges:
+                ring = loop.edge_rings.get(edge)
+                ring_ids.append(-1 if ring is None else rings.setdefault(id(ring), len(rings)))
+        self.ring_ids = np.array(ring_ids, dtype=np.int32)
+
+        self.initial_co = self.read(bm)
+        self.system = None
+        self.waves = None
+        self.straight_edges = None
+
+    def rebind(self, bm):
+        '''
+        Continues on a new bmesh of the same mesh. The Loop objects still point into the old one,
+        the flow system is built from them on the first set_flow and is reused afterwards.
+        '''
+        self.bm = bm
 
-        map_segment_onto_spline(self.verts, spline_points)
+    def __len__(self):
+        return len(self.offsets) - 1
 
+    def nbytes(self):
+        arrays = (self.offsets, self.verts, self.edges, self.valences, self.cyclic, self.ring_ids, self.initial_co)
+        return sum(a.nbytes for a in arrays)
 
+    def bytes_per_thousand_loops(self):
+        return self.nbytes() * 1000 // max(len(self), 1)
 
+    def vert_counts(self):
+        return np.diff(self.offsets)
 
-    def straighten(self, distance):
+    def read(self, bm):
         '''
-        this makes takes the end points of an edge and places them even distanced to the 'next' vert in the extension of the edge loop
-        
-        Moves A and B:
-
-        A' ------ A - B -- B' 
-    
-        to:
-
-        A' --- A --- B --- B'
+        Current positions of all loop verts, in the order of self.verts.
         '''
+        return flow.read_coordinates(bm, self.verts)
 
-        
-        edge = self.edges[0]
-
-        def find_neighbour(p):
-            link_edges = set(p.link_edges)
-            link_edges.remove(edge)
+    def write(self, bm, co, slots):
+        '''
+        Writes the positions of the given vert slots back, a vert shared by two loops gets the later one.
+        '''
+        flow.write_coordinates(bm, self.verts[slots], co[slots])
 
-            #print("face a:", edge.link_faces[0].index, "face b:", edge.link_faces[1].index)
+    def flow_system(self):
+        '''
+        The flow.FlowSystem of the loops, its stencils only depend on the topology so it is built once.
+        '''
+        if self.system is None:
+            self.system = flow.FlowSystem(self.bm, self.loops)
+        return self.system
 
-            faceA_is_quad = len(edge.link_faces[0].verts) == 4
+    def set_flow(self, tension, min_angle, **kwargs):
+        '''
+        Runs Set Flow on all loops with the coordinates of the current bmesh, see FlowSystem.set_flow.
+        '''
+        system = self.flow_system()
+        system.read(self.bm)
+        residuals = system.set_flow(tension, min_angle, **kwargs)
+        system.write(self.bm)
+        return residuals
 
-            edges = link_edges
-            if faceA_is_quad:
-                edges -= set(edge.link_faces[0].edges)
+    def set_linear(self, even_spacing):
+        '''
+        Lines up the inner verts of all open loops with at least two edges between the loop ends, in one pass.
+        even_spacing puts them at even steps, otherwise they are projected onto the line.
+        '''
+        co = self.read(self.bm)
+        starts = self.offsets[:-1]
+        ends = self.offsets[1:] - 1
+        counts = ends - starts
 
-            if not edge.is_boundary:
-                faceB_is_quad = len(edge.link_faces[1].verts) == 4
-                if faceB_is_quad:
-                    edges -= set(edge.link_faces[1].edges)
+        used = (counts >= 2) & ~self.cyclic
+        starts, ends, counts = starts[used], ends[used], counts[used]
 
-            v = mathutils.Vector((0, 0, 0))
-            count = 0
+        # interior slots of every loop and their step along it
+        inner = counts - 1
+        loop = np.repeat(np.arange(len(starts)), inner)
+        steps = np.arange(inner.sum()) - np.repeat(np.cumsum(inner) - inner, inner) + 1
+        slots = starts[loop] + steps
 
-            for e in edges:
-                for vert in e.verts:
-                    if vert == p:
-                        continue
+        p1 = co[starts]
+        direction = (co[ends] - p1) / counts[:, np.newaxis]
 
-                    v += vert.co
-                    count += 1
+        if even_spacing:
+            co[slots] = p1[loop] + direction[loop] * steps[:, np.newaxis]
+        else:
+            direction = kernels.normalized(direction)[loop]
+            scalar = ((co[slots] - p1[loop]) * direction).sum(axis=1)
+            co[slots] = p1[loop] + direction * scalar[:, np.newaxis]
 
-            if count > 0:
-                v /= count
-                
-            return v 
+        self.write(self.bm, co, slots)
 
-        a1 = edge.verts[0]
-        a2 = edge.verts[1]
+    def can_straighten(self):
+        return len(self) > 0 and bool((self.vert_counts() == 2).all())
 
-        a1_len = len(a1.link_edges)
-        a2_len = len(a2.link_edges)
-        if a1_len <= 3 or a2_len <= 3:
+    def straighten(self, distance):
+        '''
+        Moves both verts of every loop which is a single edge onto the line between the averages of their
+        neighbours beyond the edge, distance away from those and at most half of the way.
+        distance is one value or one per loop.
+        The result is the same as straightening the edges one after another: edges which read verts an earlier
+        one moves are done in a later wave, all edges of one wave are computed at once.
+        '''
+        ends, neighbours, owners, sizes, waves, loops = self.straighten_topology()
+        if not len(ends):
             return
 
-        b1 = find_neighbour(a1)
-        b2 = find_neighbour(a2)
+        involved, local = np.unique(np.concatenate((ends.ravel(), neighbours)), return_inverse=True)
+        end_local = local[:ends.size].reshape(-1, 2)
+        neighbour_local = local[ends.size:]
 
-        direction = (b2 - b1).normalized()
-        max_distance = (b2 - b1).length
+        positions = flow.read_coordinates(self.bm, involved)
+        distance = np.broadcast_to(np.asarray(distance, dtype=np.float64), (len(self),))[loops]
 
-        if distance * 2.0 > max_distance:
-            distance = max_distance * 0.5
+        for wave in range(int(waves.max()) + 1):
+            in_wave = waves == wave
+            rows = in_wave[owners // 2]
 
-        a1.co = b1 + distance * direction
-        a2.co = b2 - distance * direction
+            # average of the neighbours of each end, zero without any
+            sums = np.zeros((len(sizes), 3))
+            np.add.at(sums, owners[rows], positions[neighbour_local[rows]])
+            averages = sums / np.maximum(sizes, 1)[:, np.newaxis]
+            b1 = averages[0::2][in_wave]
+            b2 = averages[1::2][in_wave]
 
+            max_distance = np.linalg.norm(b2 - b1, axis=1)
+            direction = kernels.normalized(b2 - b1)
+            wave_distance = np.minimum(distance[in_wave], max_distance * 0.5)[:, np.newaxis]
 
-    def set_linear(self, even_spacing):        
-        count = len(self.edges)
-        if count < 2 or self.is_cyclic:
-            return
+            positions[end_local[in_wave, 0]] = b1 + wave_distance * direction
+            positions[end_local[in_wave, 1]] = b2 - wave_distance * direction
 
-        for p in self.edges[0].verts:
-            if p not in self.edges[1].verts:
-                p1 = p
+        moved = end_local.ravel()
+        flow.write_coordinates(self.bm, involved[moved], positions[moved])
 
-        for p in self.edges[-1].verts:
-            if p not in self.edges[-2].verts:
-                p2 = p
+    def straighten_topology(self):
+        '''
+        The single edges straighten moves, as vert pairs, with the verts averaged for each end
+        and the wave it is done in. Edges with an end of valence 3 or less are left out.
+        neighbours belong to end owners // 2, side owners % 2, sizes counts them per end.
+        '''
+        if self.straight_edges is None:
+            bm = self.bm
+            bm.edges.ensure_lookup_table()
+            edges = bm.edges
+
+            singles = np.flatnonzero((self.vert_counts() == 2) & ~self.cyclic)
+            ends, neighbours, owners, sizes, waves, loops = [], [], [], [], [], []
+            read_wave = {}
+            write_wave = {}
+            for loop in singles.tolist():
+                edge = edges[int(self.edges[int(self.offsets[loop]) - loop])]
+                a1, a2 = edge.verts
+                if len(a1.link_edges) <= 3 or len(a2.link_edges) <= 3:
+                    continue
 
-        direction = (p2.co - p1.co)
-        direction = direction / (count)
-        direction_normalized = direction.normalized()
+                pair = (a1.index, a2.index)
+                reads = list(pair)
+                for side, vert in enumerate((a1, a2)):
+                    others = straighten_neighbours(edge, vert)
+                    neighbours.extend(others)
+                    owners.extend([2 * len(ends) + side] * len(others))
+                    sizes.append(len(others))
+                    reads.extend(others)
+
+                # after every edge which moved a vert it reads, not before one which read what it moves
+                wave = max(max(write_wave.get(v, -1) + 1 for v in reads), max(read_wave.get(v, 0) for v in pair))
+                for v in reads:
+                    read_wave[v] = max(read_wave.get(v, 0), wave)
+                for v in pair:
+                    write_wave[v] = wave
+
+                ends.append(pair)
+                waves.append(wave)
+                loops.append(loop)
+
+            self.straight_edges = (np.array(ends, dtype=np.int64).reshape(-1, 2),
+                                   np.array(neighbours, dtype=np.int64),
+                                   np.array(owners, dtype=np.int64),
+                                   np.array(sizes, dtype=np.int64),
+                                   np.array(waves, dtype=np.int32),
+                                   np.array(loops, dtype=np.int64))
+
+        return self.straight_edges
+
+    def straighten_gaps(self):
+        '''
+        One distance per loop for straighten which keeps every edge about where it is: the mean distance
+        of its verts to the average of their neighbours. Zero for loops straighten leaves alone.
+        '''
+        gaps = np.zeros(len(self))
+        ends, neighbours, owners, sizes, waves, loops = self.straighten_topology()
+        if not len(ends):
+            return gaps
 
-        last_vert = p1
-        for i in range(count - 1):
-            vert = self.edges[i].other_vert(last_vert)           
+        end_co = flow.read_coordinates(self.bm, ends.ravel())
+        neighbour_co = flow.read_coordinates(self.bm, neighbours)
 
-            if even_spacing:
-                vert.co = p1.co + direction * (i + 1)
-            else:
-                proj = vert.co - p1.co
-                scalar = proj.dot(direction_normalized)
-                vert.co = p1.co + (direction_normalized * scalar)
+        sums = np.zeros((len(sizes), 3))
+        np.add.at(sums, owners, neighbour_co)
+        averages = sums / np.maximum(sizes, 1)[:, np.newaxis]
 
-            last_vert = vert
+        # ends without neighbours don't count
+        end_gaps = np.where(sizes > 0, np.linalg.norm(end_co - averages, axis=1), 0.0).reshape(-1, 2)
+        counted = (sizes > 0).reshape(-1, 2).sum(axis=1)
+        gaps[loops] = end_gaps.sum(axis=1) / np.maximum(counted, 1)
+        return gaps
 
+    def arc_lengths(self, co):
+        '''
+        Length along every loop from its first vert up to each vert slot.
+        '''
+        lengths = np.zeros(len(co))
+        lengths[1:] = np.linalg.norm(co[1:] - co[:-1], axis=1)
+        lengths[self.offsets[:-1]] = 0.0
+        cumulative = np.cumsum(lengths)
+        return cumulative - np.repeat(cumulative[self.offsets[:-1]], self.vert_counts())
 
-    def blend_start_end(self, blend_start, blend_end, blend_type):
-        
-        if self.is_cyclic:
-            # print("skip cyclic loop")
+    def blend_start_end(self, blend_start, blend_end, blend_type, co=None, arc_lengths=None):
+        '''
+        Blends the first blend_start and the last blend_end verts of all open loops from their initial positions
+        to co by their distance along the loop. blend_start and blend_end are vert counts per loop or for all loops.
+        co: the positions to blend, read from the bmesh if not given.
+        arc_lengths: self.arc_lengths(co), can be kept to blend the same positions again with other settings.
+
+        Loops which share a vert are blended in waves, see blend_waves, so a later loop blends from
+        the position an earlier one left, the same as blending one loop after another.
+        '''
+        counts = self.vert_counts()
+        blend_start = np.broadcast_to(np.asarray(blend_start, dtype=np.int64), counts.shape)
+        blend_end = np.broadcast_to(np.asarray(blend_end, dtype=np.int64), counts.shape)
+
+        start_count = blend_start.copy()
+        end_count = blend_end.copy()
+
+        # too long blends share the loop
+        clipped = start_count + end_count >= counts
+        shorter_start = clipped & (start_count < end_count)
+        shorter_end = clipped & (end_count < start_count)
+        even = clipped & (start_count == end_count)
+        end_count = np.where(shorter_start, np.maximum(counts - start_count - 1, 0), end_count)
+        start_count = np.where(shorter_end, np.maximum(counts - end_count - 1, 0), start_count)
+        middle = counts // 2
+        start_count = np.where(even, counts - middle, start_count)
+        end_count = np.where(even, middle, end_count)
+
+        co = self.read(self.bm) if co is None else co.copy()
+        if arc_lengths is None:
+            arc_lengths = self.arc_lengths(co)
+
+        open_loops = ~self.cyclic
+        start_ranges = np.where(open_loops & (blend_start > 0), np.minimum(counts - 1, start_count), 0)
+        end_ranges = np.where(open_loops & (blend_end > 0), np.minimum(counts - 1, end_count), 0)
+
+        waves = self.blend_waves()
+        if waves is None:
+            slots = self.blend_ranges(co, start_ranges, end_ranges, blend_type, arc_lengths)
+            self.write(self.bm, co, slots)
             return
 
-        count = len(self.verts)
-        start_count = blend_start
-        end_count = blend_end
-      
-        if start_count + end_count >= count:
-            if start_count < end_count:
-                end_count = max(count - start_count - 1, 0)
-            elif end_count < start_count:
-                start_count = max(count - end_count - 1, 0)
+        # every vert once, each wave starts from what the waves before left
+        verts, local = np.unique(self.verts, return_inverse=True)
+        current = np.zeros((len(verts), 3))
+        current[local] = co
+
+        changed = []
+        for wave in range(int(waves.max()) + 1):
+            in_wave = waves == wave
+            co = current[local]
+            if wave > 0:
+                arc_lengths = self.arc_lengths(co)
+            slots = self.blend_ranges(co, np.where(in_wave, start_ranges, 0), np.where(in_wave, end_ranges, 0),
+                                      blend_type, arc_lengths)
+            current[local[slots]] = co[slots]
+            changed.append(slots)
+
+        self.write(self.bm, current[local], np.concatenate(changed))
+
+    def blend_waves(self):
+        '''
+        Splits the open loops into waves for blending, a loop comes one wave after the last earlier loop
+        it shares a vert with. Loops of one wave never share a vert. None if no open loops share verts.
+        '''
+        if self.waves is None:
+            counts = self.vert_counts()
+            open_verts = self.verts[np.repeat(~self.cyclic, counts)]
+            if len(np.unique(open_verts)) == len(open_verts):
+                self.waves = False
             else:
-                midCount = math.floor(count / 2)
-                start_count = count - midCount
-                end_count = count - start_count
-                
-        #print(f"start:{blend_start} - end:{blend_end} - vertcount: {count}")
-        #print(f"start_count:{start_count} - end_count:{end_count} - count: {count}")
-      
-        def apply_blend(blend_range, reverse):
-            indices = list(range(count))          
-            if reverse:
-                indices.reverse()
-
-            distances = [0]
-            total_length = 0
-          
-            for i in range(1, blend_range+1):               
-                a = self.verts[indices[i]]
-                b = self.verts[indices[i-1]]
-                length = (a.co - b.co).length
-                total_length += length
-                distances.append(total_length)
-
-            # print(f"total length: {total_length} - number of distances: {len(distances)}")
-          
-            if total_length == 0:
-                return
- 
-            for i in range(blend_range+1):
-                blend_value = distances[i] / total_length                
-            
-                if blend_type == 'SMOOTH':
-                    blend_value = interpolate.smooth_step(0.0, 1.0, blend_value)
-
-                vert = self.verts[indices[i]]
-                intital_position = self.initial_vert_positions[indices[i]] 
-                vert.co = intital_position.lerp(vert.co, blend_value)
-
-        if blend_start > 0:
-            apply_blend(min(count-1, start_count), reverse=False)
-        if blend_end > 0:
-            apply_blend(min(count-1, end_count), reverse=True)
-
-
-    def set_flow(self, tension, min_angle):
-     
-        for edge in self.edges:
-            target = {}
-
-            if edge.is_boundary:
-                continue
-
-            for loop in edge.link_loops:              
-                # todo check triangles/ngons?
-
-                ring1 = loop.link_loop_next.link_loop_next
-                ring2 = loop.link_loop_radial_prev.link_loop_prev.link_loop_prev
-
-                center = edge.other_vert(loop.vert)
-
-                p1 = None
-                p2 = ring1.vert
-                p3 = ring2.link_loop_radial_next.vert
-                p4 = None
-
-                #print("ring1 %s - %s" % (ring1.vert.index, ring1.edge.index))
-                #print("ring2 %s - %s" % (ring2.vert.index, ring2.edge.index))
-                # print("p2: %s - p3: %s " % (p2.index, p3.index))
+                waves = np.zeros(len(self), dtype=np.int32)
+                offsets = self.offsets.tolist()
+                verts = self.verts.tolist()
+                last_wave = {}
+                for loop in np.flatnonzero(~self.cyclic).tolist():
+                    loop_verts = verts[offsets[loop]:offsets[loop + 1]]
+                    wave = max(last_wave.get(v, -1) for v in loop_verts) + 1
+                    for v in loop_verts:
+                        last_wave[v] = wave
+                    waves[loop] = wave
+                self.waves = waves
+
+        return None if self.waves is False else self.waves
+
+    def blend_ranges(self, co, start_ranges, end_ranges, blend_type, arc_lengths):
+        '''
+        Blends start_ranges[i] verts after the start and end_ranges[i] verts before the end of every loop,
+        returns the changed slots.
+        '''
+        starts = self.offsets[:-1]
+        lasts = self.offsets[1:] - 1
+        start_slots = self.blend(co, starts, start_ranges, 1, blend_type, arc_lengths)
 
-                result = []
-                if not ring1.edge.is_boundary:
-                    
-                    final = ring1.link_loop_radial_next.link_loop_next
-                    a, b = final.edge.verts
-                    if p2 == a:
-                        p1 = b.co
-                    else:
-                        p1 = a.co
+        # the end blend measures the loop after the start blend, which only matters where both overlap
+        if (lasts - end_ranges < starts + start_ranges)[end_ranges > 0].any():
+            arc_lengths = self.arc_lengths(co)
+        end_slots = self.blend(co, lasts, end_ranges, -1, blend_type, arc_lengths)
 
-                    a = (p1 - p2.co).normalized()
-                    b = (center.co - p2.co).normalized()
-                    dot = min(1.0, max(-1.0, a.dot(b)))
-                    angle = math.acos(dot)
+        return np.concatenate((start_slots, end_slots))
 
-                    if angle < min_angle:
-                        # print("r1: %s" % (math.degrees(angle)))
-                        p1 = p2.co - (p3.co - p2.co) * 0.5
-                        # bmesh.ops.create_vert(self.bm, co=p1)
+    def blend(self, co, firsts, ranges, direction, blend_type, arc_lengths):
+        '''
+        Blends the verts firsts[i] ... firsts[i] + direction * ranges[i] of every loop from the initial positions
+        to co by their distance along the loop. Returns the changed slots.
+        '''
+        used = ranges > 0
+        firsts, ranges = firsts[used], ranges[used]
+        sizes = ranges + 1
 
-                else:
-                    p1 = p2.co - (p3.co - p2.co)
-                    # bmesh.ops.create_vert(self.bm, co=p1)
+        loop = np.repeat(np.arange(len(firsts)), sizes)
+        steps = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        slots = firsts[loop] + steps * direction
 
-                result.append(p1)
-                result.append(p2.co)
+        distances = (arc_lengths[slots] - arc_lengths[firsts][loop]) * direction
+        totals = (arc_lengths[firsts + ranges * direction] - arc_lengths[firsts]) * direction
 
-                if not ring2.edge.is_boundary:
-                    is_quad = len(ring2.face.verts) == 4
-                    # if is_quad:
-                    final = ring2.link_loop_radial_prev.link_loop_prev
-                    # else:
-                    #    final = ring2
+        moving = totals[loop] > 0.0
+        slots, loop, distances = slots[moving], loop[moving], distances[moving]
 
-                    #print("is_quad:", is_quad, " - ", final.edge.index)
+        values = np.minimum(distances / totals[loop], 1.0)
+        if blend_type == 'SMOOTH':
+            values = interpolate.smooth_step_batch(0.0, 1.0, values)
 
-                    a, b = final.edge.verts
+        values = values[:, np.newaxis]
+        co[slots] = self.initial_co[slots] * (1.0 - values) + co[slots] * values
+        return slots
 
-                    if p3 == a:
-                        p4 = b.co
-                    else:
-                        p4 = a.co
+    def set_curve_flow(self, tension, use_rail, rail_type, rail_start, rail_end, tolerance=0.0001):
+        '''
+        Puts the inner verts of all open loops with at least two edges on a bezier between the loop ends,
+        leaving along the first and last edge. The bezier controls of every loop
+        are computed as arrays, all curves are flattened together and the verts are resampled onto them in one go.
+        '''
+        co = self.read(self.bm)
+        starts = self.offsets[:-1]
+        lasts = self.offsets[1:] - 1
+        used = (lasts - starts >= 2) & ~self.cyclic
+        starts, lasts = starts[used], lasts[used]
+        if len(starts) == 0:
+            return
 
-                    a = (p4 - p3.co).normalized()
-                    b = (center.co - p3.co).normalized()
-                    dot = min(1.0, max(-1.0, a.dot(b)))
-                    angle = math.acos(dot)
+        start_co = co[starts]
+        end_co = co[lasts]
+        dir1_unnormalized = co[starts + 1] - start_co
+        dir1 = kernels.normalized(dir1_unnormalized)
+        dir2_unnormalized = co[lasts - 1] - end_co
+        dir2 = kernels.normalized(dir2_unnormalized)
 
-                    if angle < min_angle:
-                        # print("r2: %s" % (math.degrees(angle)))
-                        p4 = p3.co - (p2.co - p3.co) * 0.5
+        if use_rail:
+            if rail_type == 'ABSOLUTE':
+                p1 = start_co + (dir1_unnormalized - dir1 * rail_start)
+                p4 = end_co + (dir2_unnormalized - dir2 * rail_end)
+            else: # == 'FACTOR'
+                p1 = start_co + dir1_unnormalized * rail_start
+                p4 = end_co + dir2_unnormalized * rail_end
+        else:
+            p1 = start_co
+            p4 = end_co
 
-                        # bmesh.ops.create_vert(self.bm, co=p4)
+        scale = np.linalg.norm(p1 - p4, axis=1) * 0.5
+        scale = (scale * tension)[:, np.newaxis]
 
-                else:
-                    # radial_next doenst work at boundary
-                    p3 = ring2.edge.other_vert(p3)
-                    p4 = p3.co - (p2.co - p3.co)
-                    # bmesh.ops.create_vert(self.bm, co=p4)
+        p2 = p1 + dir1 * scale
+        p3 = p4 + dir2 * scale
 
-                result.append(p3.co)
-                result.append(p4)
+        controls = np.stack((p1, p2, p3, p4), axis=1)
+        polylines = arclength.flatten(arclength.spline(controls, interpolate.bezier_weights), len(controls), tolerance)
 
-                target[center] = result
+        sizes = [len(polyline) for polyline in polylines]
+        offsets = np.concatenate(([0], np.cumsum(sizes)))
+        counts = lasts - starts + 1
+        positions = arclength.resample(np.concatenate(polylines), offsets, counts)
 
-            for vert, points in target.items():
-                p1, p2, p3, p4 = points
+        # only the inner verts move
+        inner = counts - 2
+        loop = np.repeat(np.arange(len(starts)), inner)
+        steps = np.arange(inner.sum()) - np.repeat(np.cumsum(inner) - inner, inner) + 1
+        co[starts[loop] + steps] = positions[(np.cumsum(counts) - counts)[loop] + steps]
 
-                if p1 == p2 or p3 == p4:
-                    print("invalid input - two control points are identical!")
-                    continue
+        self.write(self.bm, co, starts[loop] + steps)
 
-                # normalize point distances so that long edges dont skew the curve
-                d = (p2 - p3).length * 0.5
 
-                p1 = p2 + (d * (p1 - p2).normalized())
-                p4 = p3 + (d * (p4 - p3).normalized())
-              
-                # result = interpolate.catmullrom(p1, p2, p3, p4, 1, 3)[1]
-                result = interpolate.hermite_3d(p1, p2, p3, p4, 0.5, -tension, 0)
-                result = mathutils.Vector(result)                
-                vert.co = result
- 
-            
+def straighten_neighbours(edge, vert):
+    '''
+    Indices of the verts beyond vert in the extension of edge, the ones LoopSet.straighten averages.
+    Edges of the quads next to the edge are skipped.
+    '''
+    # the faces to look at, the first one of a boundary edge and the first two otherwise
+    faces = edge.link_faces[:1] if edge.is_boundary else edge.link_faces[:2]
+    skip = {edge}
+    for face in faces:
+        if len(face.verts) == 4:
+            skip.update(face.edges)
 
+    return [e.other_vert(vert).index for e in vert.link_edges if e not in skip]
@@ -0,0 +1,811 @@
+import collections
+import concurrent.futures
+import itertools
+import operator
+import pickle
+import subprocess
+import sys
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from . import interpolate
+from . import kernels
+from . import schedule
+from .kernels import CENTER, P1, P2, P3, EXTRAPOLATE_P1, EXTRAPOLATE_P4
+from .kernels import apply, evaluate, iterate, run_program
+
+
+solvers = (
+    ("SEQUENTIAL", "Sequential", "Updates loop after loop in place, each loop sees the moves of the loops before"),
+    ("JACOBI", "Jacobi", "Updates all verts at once from the positions of the last iteration, damped to stay stable"),
+    ("RED_BLACK", "Red-Black", "Updates groups of loops which don't see each other together, one group after another"),
+    ("DIRECT", "Direct", "Solves for the steady shape of every edge ring at once, each iteration refines the solve"),
+)
+
+accelerations = (
+    ("NONE", "None", "Plain repeated updates"),
+    ("ANDERSON", "Anderson", "Extrapolates from the last updates to reach the steady shape in fewer iterations"),
+)
+
+
+class LoopStencil():
+    '''
+    The verts Set Flow moves in one edge loop, together with the verts their curve is built from.
+    Every row holds the local indices of center, p1, p2, p3_start, p3 and p4, codes tells which of p1 and p4
+    are extrapolated - their index then repeats p2 or p3. p3_start is the p3 seen while p1 is computed,
+    which differs from p3 at a boundary.
+
+    Rows are grouped into waves: the rows of one wave are evaluated together and only
+    depend on the writes of earlier waves, so the in place order of set_flow is kept.
+    '''
+
+    def __init__(self, rows, codes, edge_numbers):
+        rows = np.array(rows, dtype=np.int32).reshape(-1, 6)
+        codes = np.array(codes, dtype=np.uint8)
+        edge_numbers = np.array(edge_numbers, dtype=np.int32)
+
+        centers = set(rows[:, CENTER].tolist())
+        conflict = bool(np.isin(rows[:, P1:], list(centers)).any())
+
+        if conflict:
+            # a control vert is moved by the same loop, fall back to one wave per edge
+            waves = edge_numbers
+        else:
+            # the n-th write to a vert only depends on the writes before it
+            waves = np.zeros(len(rows), dtype=np.int32)
+            seen = {}
+            for i, center in enumerate(rows[:, CENTER].tolist()):
+                waves[i] = seen.get(center, 0)
+                seen[center] = waves[i] + 1
+
+        order = np.argsort(waves, kind="stable")
+        self.indices = rows[order]
+        self.codes = codes[order]
+        waves = waves[order]
+
+        bounds = np.flatnonzero(np.diff(waves)) + 1
+        starts = np.concatenate(([0], bounds))
+        ends = np.concatenate((bounds, [len(rows)]))
+        self.waves = [slice(int(a), int(b)) for a, b in zip(starts, ends) if b > a]
+
+    def __len__(self):
+        return len(self.indices)
+
+    def nbytes(self):
+        return self.indices.nbytes + self.codes.nbytes
+
+
+def build_stencil(loop, local_index):
+    '''
+    Walks the topology around every edge of the loop: the ring edges at both verts and the edges beyond them.
+    local_index maps a BMVert to its row in the coordinate array.
+    '''
+    rows = []
+    codes = []
+    edge_numbers = []
+
+    for edge_number, edge in enumerate(loop.edges):
+        if edge.is_boundary:
+            continue
+
+        target = {}
+        for corner in edge.link_loops:
+            ring1 = corner.link_loop_next.link_loop_next
+            ring2 = corner.link_loop_radial_prev.link_loop_prev.link_loop_prev
+
+            center = edge.other_vert(corner.vert)
+
+            p1 = None
+            p2 = ring1.vert
+            p3 = ring2.link_loop_radial_next.vert
+            p3_start = p3
+            p4 = None
+
+            if not ring1.edge.is_boundary:
+                final = ring1.link_loop_radial_next.link_loop_next
+                a, b = final.edge.verts
+                p1 = b if p2 == a else a
+
+            if not ring2.edge.is_boundary:
+                final = ring2.link_loop_radial_prev.link_loop_prev
+                a, b = final.edge.verts
+                p4 = b if p3 == a else a
+            else:
+                # radial_next doenst work at boundary
+                p3 = ring2.edge.other_vert(p3)
+
+            target[center] = (center, p1, p2, p3_start, p3, p4)
+
+        for center, p1, p2, p3_start, p3, p4 in target.values():
+            code = 0
+            if p1 is None:
+                code |= EXTRAPOLATE_P1
+                p1 = p2
+            if p4 is None:
+                code |= EXTRAPOLATE_P4
+                p4 = p3
+
+            rows.append([local_index(v) for v in (center, p1, p2, p3_start, p3, p4)])
+            codes.append(code)
+            edge_numbers.append(edge_number)
+
+    return LoopStencil(rows, codes, edge_numbers)
+
+
+class FlowSystem():
+    '''
+    Runs Set Flow on arrays: the coordinates of all verts the loops touch are read once,
+    every iteration only gathers control points, evaluates the curves and scatters the results.
+    Loops are still processed one after another, as each loop sees the moves of the loops before.
+    The order comes from a schedule.Schedule over the loops, all solvers follow it.
+
+    The stencils only hold vert indices, so a system can be reused for the same selection
+    on a new bmesh of the same mesh - like the one the redo panel hands over.
+    '''
+    # below this many stencil rows a thread pool costs more than it saves
+    min_parallel_rows = 5000
+    # from this many stencil rows on starting worker processes pays off
+    min_process_rows = 200000
+
+    def __init__(self, bm, loops):
+        local = {}
+        verts = []
+
+        def local_index(vert):
+            index = local.get(vert.index)
+            if index is None:
+                index = len(verts)
+                local[vert.index] = index
+                verts.append(vert.index)
+            return index
+
+        stencils = [build_stencil(loop, local_index) for loop in loops]
+        self.vert_indices = np.array(verts, dtype=np.int32)
+
+        self.set_stencils(stencils, [getattr(loop, "max_valence", 0) for loop in loops])
+        self.co = self.read(bm)
+
+    def set_stencils(self, stencils, priorities):
+        self.stencils = stencils
+        self.priorities = priorities
+        self.schedule = schedule.Schedule(stencil_graph(stencils), priorities)
+
+        moved = [s.indices[:, CENTER] for s in stencils if len(s)]
+        self.moved = np.unique(np.concatenate(moved)) if moved else np.zeros(0, dtype=np.int32)
+        self.crossing = crossing_loops(stencils, self.schedule.component)
+
+        self.residuals = []
+        self.evaluations = 0
+        self.pool = None
+        self.parallel_parts = 0
+        self.speedup = 1.0
+        self._row_seconds = {}
+        self._jacobi = None
+        self._colors = None
+        self._rings = None
+        self._parts = None
+
+    def nbytes(self):
+        size = self.vert_indices.nbytes + self.moved.nbytes + self.crossing.nbytes + sum(s.nbytes() for s in self.stencils)
+        size += self.schedule.nbytes()
+        if self._jacobi is not None:
+            size += self._jacobi[0].nbytes + self._jacobi[1].nbytes
+        if self._colors is not None:
+            size += sum(indices.nbytes + codes.nbytes for indices, codes in self._colors)
+        if self._rings is not None:
+            size += self._rings.nbytes()
+        return size
+
+    def read(self, bm):
+        '''
+        Loads the current coordinates of all verts of the system from the bmesh.
+        '''
+        self.co = read_coordinates(bm, self.vert_indices)
+        return self.co
+
+    def write(self, bm):
+        '''
+        Writes the moved verts back to the bmesh.
+        '''
+        write_coordinates(bm, self.vert_indices[self.moved], self.co[self.moved])
+
+    def set_flow(self, tension, min_angle, iterations=1, solver="SEQUENTIAL", tolerance=0.0, use_active_set=False,
+                 acceleration="NONE", workers=1):
+        '''
+        Repeats the flow update until no vert moves further than tolerance, at most iterations times.
+        Returns the residual of every iteration - the largest distance a vert moved in it.
+
+        use_active_set: after the first iteration only rows are evaluated where the center or
+                        a control vert moved further than tolerance in the iteration before.
+        acceleration: "ANDERSON" mixes the positions after every update but the last, see AndersonMixer.
+                      All verts move then, so it can't be combined with the active set.
+        solver: "DIRECT" solves every edge ring at once instead of updating it, see RingSystems.
+                Each iteration is one solve, the active set doesn't apply to it.
+                Components with crossing loops are always updated in sequence, see crossing_loops.
+        workers: with more than one, the schedule components are spread over a pool of threads,
+                 or of processes for very large systems, see set_flow_parallel and set_flow_processes.
+                 Only runs of a fixed number of plain iterations are spread, tolerance 0 without acceleration,
+                 as a component stopping or mixing on its own would give another result than the whole system.
+        The number of evaluated rows is counted in self.evaluations.
+        '''
+        settings = (tension, min_angle, iterations, solver, tolerance, use_active_set, acceleration)
+        rows = self.rows()
+        fixed = tolerance <= 0.0 and acceleration == "NONE"
+        if fixed and workers > 1 and len(self.schedule.components) > 1 and rows >= self.min_parallel_rows:
+            if rows >= self.min_process_rows and solver != "DIRECT":
+                return self.set_flow_processes(workers, *settings)
+            return self.set_flow_parallel(workers, *settings)
+
+        self.pool = None
+        self.parallel_parts = 0
+        self.speedup = 1.0
+        weights = interpolate.hermite_table(2, -tension, 0)[1]
+
+        if solver == "DIRECT":
+            def step(changed):
+                return self.step_direct(weights, min_angle)
+        else:
+            def step(changed):
+                return run_program(self.co, self.program(solver, weights), weights, min_angle, changed)
+
+        mixer = AndersonMixer() if acceleration == "ANDERSON" else None
+        self.residuals, self.evaluations = iterate(self.co, step, self.moved, iterations, tolerance,
+                                                  use_active_set, mixer)
+        return self.residuals
+
+    def set_flow_parallel(self, workers, *settings):
+        '''
+        Runs set_flow on every component of the schedule in a pool of worker threads.
+        Components never read what another one moves, so they all work in place on the shared coordinates,
+        and NumPy releases the GIL inside its array kernels. The residual of an iteration is the largest one
+        of all components. This only gives the result of set_flow for runs of a fixed number of plain iterations,
+        set_flow doesn't hand other runs over. A component only stops early there once nothing in it moves,
+        and then it wouldn't move in the remaining iterations either.
+        self.speedup: how much faster than the components one after another on a single thread, see row_seconds.
+        self.parallel_parts: the number of components.
+        '''
+        parts = self.components()
+        row_seconds = self.row_seconds(parts, settings)
+
+        # largest first, so no worker is left with a big component at the end
+        parts = sorted(parts, key=lambda part: -part.rows())
+
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(lambda part: part.set_flow(*settings), parts))
+        elapsed = time.perf_counter() - start
+
+        self.gather([(part.residuals, part.evaluations) for part in parts], "threads", row_seconds, elapsed)
+        return self.residuals
+
+    def set_flow_processes(self, workers, tension, min_angle, iterations, solver, tolerance, use_active_set,
+                           acceleration):
+        '''
+        set_flow_parallel with worker processes, which don't share the GIL with Blender at all.
+        The coordinates are copied into a shared memory block the workers update in place, each one
+        gets the programs of its components and runs kernels.py on them, which only needs NumPy.
+        Starting a process costs much more than a thread, so this only pays off for very large systems.
+        If a worker can't be started or fails, the threads take over.
+        '''
+        settings = (tension, min_angle, iterations, solver, tolerance, use_active_set, acceleration)
+        parts = self.components()
+        row_seconds = self.row_seconds(parts, settings)
+        weights = interpolate.hermite_table(2, -tension, 0)[1]
+
+        # largest components first, each to the worker with the least rows so far
+        jobs = [[] for _ in range(min(workers, len(parts)))]
+        loads = [0] * len(jobs)
+        for part in sorted(parts, key=lambda part: -part.rows()):
+            worker = loads.index(min(loads))
+            jobs[worker].append((part.program(solver, weights), part.moved))
+            loads[worker] += part.rows()
+
+        memory = shared_memory.SharedMemory(create=True, size=max(self.co.nbytes, 1))
+        try:
+            shared = np.ndarray(self.co.shape, dtype=np.float64, buffer=memory.buf)
+            shared[:] = self.co
+
+            start = time.perf_counter()
+            results = run_workers(memory.name, self.co.shape, (weights, min_angle, iterations, tolerance, use_active_set), jobs)
+            elapsed = time.perf_counter() - start
+
+            if results is not None:
+                self.co[:] = shared
+            del shared
+        finally:
+            memory.close()
+            memory.unlink()
+
+        if results is None:
+            return self.set_flow_parallel(workers, *settings)
+
+        self.gather(results, "processes", row_seconds, elapsed)
+        return self.residuals
+
+    def gather(self, results, pool, row_seconds, elapsed):
+        '''
+        Joins the (residuals, evaluations) of all components of a parallel run,
+        the residual of an iteration is the largest one of all components.
+        '''
+        count = max(len(residuals) for residuals, _ in results)
+        self.residuals = [max(residuals[i] for residuals, _ in results if i < len(residuals)) for i in range(count)]
+        self.evaluations = sum(evaluations for _, evaluations in results)
+        self.pool = pool
+        self.parallel_parts = len(results)
+        self.speedup = row_seconds * self.evaluations / elapsed if elapsed > 0.0 else 1.0
+
+    def row_seconds(self, parts, settings):
+        '''
+        Seconds per evaluated row of the components run one after another on this thread, the baseline of
+        self.speedup. It is measured once per solver, by running the components on a copy of the coordinates.
+        '''
+        solver = settings[3]
+        if solver not in self._row_seconds:
+            co = self.co.copy()
+            for part in parts:
+                part.co = co
+
+            start = time.perf_counter()
+            for part in parts:
+                part.set_flow(*settings)
+            seconds = time.perf_counter() - start
+
+            for part in parts:
+                part.co = self.co
+            self._row_seconds[solver] = seconds / max(sum(part.evaluations for part in parts), 1)
+
+        return self._row_seconds[solver]
+
+    def components(self):
+        '''
+        A FlowSystem for every component of the schedule, working on the coordinates of this one.
+        '''
+        if self._parts is None:
+            self._parts = []
+            for loops in self.schedule.components:
+                part = FlowSystem.__new__(FlowSystem)
+                part.vert_indices = self.vert_indices
+                part.set_stencils([self.stencils[l] for l in loops.tolist()], [self.priorities[l] for l in loops.tolist()])
+                self._parts.append(part)
+
+        # read() replaces the array
+        for part in self._parts:
+            part.co = self.co
+        return self._parts
+
+    def rows(self):
+        return sum(len(s) for s in self.stencils)
+
+    def scheduled_stencils(self, crossing=None):
+        '''
+        The stencils in schedule order, only the ones of crossing or of other loops if crossing is given.
+        '''
+        order = self.schedule.order
+        if crossing is not None:
+            order = order[self.crossing[order] == crossing]
+        return [self.stencils[loop] for loop in order.tolist()]
+
+    def program(self, solver, weights):
+        '''
+        The rows one iteration of the solver evaluates, as (indices, codes, relaxation) steps in update order,
+        see kernels.run_program. Crossing loops are swept in sequence after the rest. Not for "DIRECT".
+        '''
+        if solver == "SEQUENTIAL":
+            return sweep(self.scheduled_stencils())
+
+        crossing = sweep(self.scheduled_stencils(crossing=True))
+        if solver == "JACOBI":
+            if self._jacobi is None:
+                indices, codes = last_writes(self.scheduled_stencils(crossing=False))
+                coupled = np.isin(indices[:, P1:], indices[:, CENTER]).any(axis=1)
+                self._jacobi = (indices, codes, coupled)
+
+            # all rows read the positions before any of them is written,
+            # only rows which read moved verts need damping
+            indices, codes, coupled = self._jacobi
+            relaxation = np.where(coupled, jacobi_damping(weights), 1.0)
+            return [(indices, codes, relaxation)] + crossing
+
+        if self._colors is None:
+            batches = [batch[~self.crossing[batch]] for batch in self.schedule.batches]
+            self._colors = batch_waves(self.stencils, batches)
+        return [(indices, codes, None) for indices, codes in self._colors] + crossing
+
+    def step_direct(self, weights, min_angle):
+        if self._rings is None:
+            self._rings = RingSystems(*last_writes(self.scheduled_stencils(crossing=False)), vert_count=len(self.co))
+
+        count = self._rings.solve(self.co, weights, min_angle)
+        return count + run_program(self.co, sweep(self.scheduled_stencils(crossing=True)), weights, min_angle)
+
+
+def sweep(stencils):
+    '''
+    The waves of the stencils one after another, as steps for kernels.run_program.
+    '''
+    return [(s.indices[wave], s.codes[wave], None) for s in stencils for wave in s.waves]
+
+
+def run_workers(name, shape, settings, jobs):
+    '''
+    Runs kernels.py in a process for every list of jobs, on the coordinates in the shared memory block name.
+    Returns the results of all jobs, or None if a worker failed.
+    '''
+    try:
+        workers = [subprocess.Popen([sys.executable, kernels.__file__], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+                   for _ in jobs]
+    except OSError:
+        return None
+
+    # all workers are started before any input is written, so they import NumPy at the same time
+    results = []
+    failed = False
+    for worker, worker_jobs in zip(workers, jobs):
+        try:
+            worker.stdin.write(pickle.dumps((name, shape, settings, worker_jobs)))
+            worker.stdin.close()
+        except OSError:
+            failed = True
+
+    for worker in workers:
+        output = worker.stdout.read()
+        if worker.wait() != 0 or failed:
+            failed = True
+            continue
+        results.extend(pickle.loads(output))
+
+    return None if failed else results
+
+
+def read_coordinates(bm, indices):
+    '''
+    (N,3) coordinates of the bmesh verts with the given indices. BMesh has no foreach_get,
+    but mapping the lookups keeps the loop over the verts in C instead of running python code for each.
+    '''
+    verts = map(bm.verts.__getitem__, np.asarray(indices).tolist())
+    values = itertools.chain.from_iterable(map(operator.attrgetter("co"), verts))
+    return np.fromiter(values, dtype=np.float64, count=3 * len(indices)).reshape(-1, 3)
+
+
+def write_coordinates(bm, indices, co):
+    '''
+    Sets the coordinates of the bmesh verts with the given indices, the counterpart of read_coordinates.
+    '''
+    verts = map(bm.verts.__getitem__, np.asarray(indices).tolist())
+    collections.deque(map(setattr, verts, itertools.repeat("co"), np.asarray(co).tolist()), maxlen=0)
+
+
+class AndersonMixer():
+    '''
+    Anderson mixing for the fixed point iteration x = G(x), with G being one flow update of all moved verts.
+    The next positions combine the last updates so that their residuals G(x) - x cancel out as far as possible,
+    which skips most of the slow creeping of long rings.
+
+    If the residual grows by more than safeguard the history is dropped and the plain update is taken,
+    so a diverging extrapolation falls back to the normal iteration.
+    '''
+
+    def __init__(self, depth=5, safeguard=2.0):
+        self.depth = depth
+        self.safeguard = safeguard
+        self.fallbacks = 0
+        self.reset()
+
+    def reset(self):
+        self.residuals = []
+        self.updates = []
+        self.last_norm = None
+
+    def mix(self, x, g):
+        '''
+        x: positions before the update, g: positions after it. Returns the positions to continue with.
+        '''
+        residual = (g - x).ravel()
+        norm = float(np.linalg.norm(residual))
+
+        if self.last_norm is not None and not (norm <= self.last_norm * self.safeguard):
+            self.fallbacks += 1
+            self.reset()
+            self.last_norm = norm
+            return g
+
+        self.last_norm = norm
+        self.residuals.append(residual)
+        self.updates.append(g.ravel().copy())
+        if len(self.residuals) > self.depth + 1:
+            del self.residuals[0]
+            del self.updates[0]
+
+        if len(self.residuals) < 2:
+            return g
+
+        delta_residuals = np.diff(np.array(self.residuals), axis=0).T
+        delta_updates = np.diff(np.array(self.updates), axis=0).T
+
+        gamma = np.linalg.lstsq(delta_residuals, residual, rcond=None)[0]
+        mixed = g.ravel() - delta_updates @ gamma
+        if not np.isfinite(mixed).all():
+            self.fallbacks += 1
+            self.reset()
+            return g
+
+        return mixed.reshape(g.shape)
+
+
+def jacobi_damping(weights):
+    '''
+    Along a ring every vert becomes w1 * (x[-2] + x[2]) + w2 * (x[-1] + x[1]), the tips overshoot for positive tension.
+    An undamped simultaneous update amplifies the alternating mode, whose factor is 2 * (w1 - w2),
+    so the step is scaled to stay well inside the stable range.
+    '''
+    w1, w2 = weights[0], weights[1]
+    lowest = 2.0 * (w1 - w2)
+    return min(1.0, 1.6 / (1.0 - lowest))
+
+
+def crossing_loops(stencils, component):
+    '''
+    Marks the loops of every schedule component in which a vert is moved along more than one edge ring,
+    like where two selected loops cross. The sequential update leaves such a vert where its last row puts it,
+    but the loops in between read where the earlier rows put it, so the steady shape depends on the order.
+    Only the sequential sweep gives that shape, the other solvers leave these components to it.
+    The two edges of a loop at a vert move it from both sides of the same ring, with p2 and p3 swapped.
+    '''
+    if not stencils:
+        return np.zeros(0, dtype=bool)
+
+    indices = np.concatenate([s.indices for s in stencils])
+    loops = np.repeat(np.arange(len(stencils)), [len(s) for s in stencils])
+
+    rings = np.column_stack((indices[:, CENTER], np.sort(indices[:, [P2, P3]], axis=1)))
+    centers, counts = np.unique(np.unique(rings, axis=0)[:, 0], return_counts=True)
+    shared = np.isin(indices[:, CENTER], centers[counts > 1])
+    return np.isin(component, component[loops[shared]])
+
+
+def last_writes(stencils):
+    '''
+    The row of the last write to every vert in sequential order. Without crossing loops every write
+    to a vert uses the same row, so at the steady state the last one gives the result of all.
+    '''
+    indices = [s.indices[wave] for s in stencils for wave in s.waves]
+    codes = [s.codes[wave] for s in stencils for wave in s.waves]
+    if not indices:
+        return np.zeros((0, 6), dtype=np.int32), np.zeros(0, dtype=np.uint8)
+
+    indices = np.concatenate(indices)
+    codes = np.concatenate(codes)
+
+    _, last = np.unique(indices[::-1, CENTER], return_index=True)
+    rows = np.sort(len(indices) - 1 - last)
+    return indices[rows], codes[rows]
+
+
+def stencil_graph(stencils):
+    '''
+    schedule.RingGraph of the loops of the stencils: two loops are linked when one reads or moves a vert the other moves.
+    '''
+    count = len(stencils)
+    reads = [np.unique(s.indices) for s in stencils]
+    writes = [np.unique(s.indices[:, CENTER]) for s in stencils]
+    if not count:
+        return schedule.RingGraph(0, [])
+
+    read_loops = np.repeat(np.arange(count), [len(r) for r in reads])
+    read_verts = np.concatenate(reads)
+    write_loops = np.repeat(np.arange(count), [len(w) for w in writes])
+    write_verts = np.concatenate(writes)
+
+    order = np.argsort(write_verts, kind="stable")
+    write_verts, write_loops = write_verts[order], write_loops[order]
+
+    # every loop reading a vert is paired with every loop writing it
+    first = np.searchsorted(write_verts, read_verts, side="left")
+    counts = np.searchsorted(write_verts, read_verts, side="right") - first
+    readers = np.repeat(read_loops, counts)
+    slots = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts - first, counts)
+
+    return schedule.RingGraph(count, np.stack((readers, write_loops[slots]), axis=1))
+
+
+def batch_waves(stencils, batches):
+    '''
+    Joins the stencils of the loops in every schedule batch wave by wave.
+    Loops of one batch don't see each other, so a batch gives the same result as updating its loops one by one.
+    Returns indices and codes of all rows that are evaluated together, in update order.
+    '''
+    rows = []
+    for batch in batches:
+        loops = [stencils[loop] for loop in batch.tolist()]
+        for wave in range(max((len(s.waves) for s in loops), default=0)):
+            parts = [s for s in loops if wave < len(s.waves)]
+            indices = np.concatenate([s.indices[s.waves[wave]] for s in parts])
+            codes = np.concatenate([s.codes[s.waves[wave]] for s in parts])
+            rows.append((indices, codes))
+    return rows
+
+
+def linearize(co, indices, codes, weights, min_angle):
+    '''
+    Splits the update of every row into the average of its two ring neighbours p2 and p3
+    and an offset, the part the outer control points add. Returns the (N,3) offsets and which rows are valid.
+    '''
+    result, valid = evaluate(co, indices, codes, weights, min_angle)
+    w1, w2, w3, w4 = weights
+    offsets = result - co[indices[:, P2]] * (w1 + w2) - co[indices[:, P3]] * (w3 + w4)
+    return offsets, valid
+
+
+class RingSystems():
+    '''
+    The steady state of the flow update, solved directly instead of iterated.
+    Every update is the average of the ring neighbours p2 and p3 plus an offset given by the outer control points.
+    With the offsets held at the current positions, x = (p2 + p3) / 2 + offset is linear and only couples
+    the moved verts of one edge ring. Ordered along the ring the rows are tridiagonal,
+    so all open rings are padded to the same length and eliminated together.
+    Solving again with the new offsets converges to the steady state of the plain update.
+
+    Closed rings have no unique solution, all verts could shift together,
+    their rows keep using the plain update. Rings which branch are solved densely.
+    The rows only describe the steady state without crossing loops, FlowSystem sweeps those instead.
+    '''
+    max_dense = 2000
+
+    def __init__(self, indices, codes, vert_count):
+        self.indices = indices
+        self.codes = codes
+
+        centers = indices[:, CENTER]
+        unknown_of = np.full(vert_count, -1, dtype=np.int64)
+        unknown_of[centers] = np.arange(len(centers))
+        self.neighbours = unknown_of[indices[:, [P2, P3]]]
+
+        paths, cycles, others = self.find_rings()
+
+        self.batch = np.full(len(centers), -1, dtype=np.int64)
+        self.position = np.zeros(len(centers), dtype=np.int64)
+        for b, path in enumerate(paths):
+            self.batch[path] = b
+            self.position[path] = np.arange(len(path))
+        self.ring_count = len(paths)
+        self.length = max([len(p) for p in paths], default=0)
+        self.rows = np.flatnonzero(self.batch >= 0)
+
+        self.dense = [np.array(group) for group in others if len(group) <= self.max_dense]
+        solved = np.concatenate([self.rows] + self.dense).astype(np.int64)
+        self.iterated = np.setdiff1d(np.arange(len(centers)), solved)
+
+    def nbytes(self):
+        size = self.indices.nbytes + self.codes.nbytes + self.neighbours.nbytes
+        size += self.batch.nbytes + self.position.nbytes + self.rows.nbytes + self.iterated.nbytes
+        return size + sum(group.nbytes for group in self.dense)
+
+    def find_rings(self):
+        '''
+        Splits the rows into rings of rows linked through p2 and p3, the open rings are ordered from one end.
+        Returns the open, the closed and the branching rings.
+        '''
+        count = len(self.neighbours)
+        links = [set() for _ in range(count)]
+        for row, pair in enumerate(self.neighbours.tolist()):
+            for other in pair:
+                if other >= 0 and other != row:
+                    links[row].add(other)
+                    links[other].add(row)
+
+        paths, cycles, others = [], [], []
+        seen = [False] * count
+        for start in range(count):
+            if seen[start]:
+                continue
+
+            group = [start]
+            seen[start] = True
+            for row in group:
+                for other in links[row]:
+                    if not seen[other]:
+                        seen[other] = True
+                        group.append(other)
+
+            if len(group) == 1:
+                paths.append(group)
+                continue
+
+            degrees = [len(links[row]) for row in group]
+            ends = [row for row, degree in zip(group, degrees) if degree == 1]
+            if max(degrees) > 2:
+                others.append(group)
+            elif not ends:
+                cycles.append(group)
+            else:
+                order = [ends[0]]
+                previous = -1
+                while len(order) < len(group):
+                    following = [row for row in links[order[-1]] if row != previous]
+                    previous = order[-1]
+                    order.append(following[0])
+                paths.append(order)
+
+        return paths, cycles, others
+
+    def solve(self, co, weights, min_angle):
+        '''
+        Moves all centers to the steady state for the current offsets. Returns the number of rows used.
+        '''
+        offsets, valid = linearize(co, self.indices, self.codes, weights, min_angle)
+        w1, w2, w3, w4 = weights
+        factors = np.array((w1 + w2, w3 + w4))
+        centers = self.indices[:, CENTER]
+
+        # neighbours which don't move are constants, invalid rows stay where they are
+        coupled = np.where(self.neighbours >= 0, factors, 0.0)
+        coupled[~valid] = 0.0
+        constant = np.where(self.neighbours < 0, factors, 0.0)
+        b = offsets + np.einsum('nk,nkd->nd', constant, co[self.indices[:, [P2, P3]]])
+        b[~valid] = co[centers[~valid]]
+
+        x = co[centers]
+        if self.ring_count:
+            self.solve_tridiagonal(coupled, b, x)
+        for group in self.dense:
+            x[group] = self.solve_dense(group, coupled, b, x)
+
+        co[centers] = x
+        if len(self.iterated):
+            apply(co, self.indices[self.iterated], self.codes[self.iterated], weights, min_angle)
+
+        return len(self.indices)
+
+    def solve_tridiagonal(self, coupled, b, x):
+        '''
+        Thomas algorithm on all open rings at once. Every row is weakly diagonally dominant,
+        strictly at the ends of a ring, so no pivoting is needed.
+        '''
+        rows = self.rows
+        batch = self.batch[rows]
+        position = self.position[rows]
+
+        lower = np.zeros((self.ring_count, self.length))
+        upper = np.zeros((self.ring_count, self.length))
+        diagonal = np.ones((self.ring_count, self.length))
+        rhs = np.zeros((self.ring_count, self.length, 3))
+        rhs[batch, position] = b[rows]
+
+        for column in range(2):
+            other = self.neighbours[rows, column]
+            inside = other >= 0
+            offset = self.position[other[inside]] - position[inside]
+            target = (batch[inside], position[inside])
+            np.add.at(lower, target, np.where(offset < 0, -coupled[rows[inside], column], 0.0))
+            np.add.at(upper, target, np.where(offset > 0, -coupled[rows[inside], column], 0.0))
+
+        for i in range(1, self.length):
+            factor = lower[:, i] / diagonal[:, i - 1]
+            diagonal[:, i] -= factor * upper[:, i - 1]
+            rhs[:, i] -= factor[:, np.newaxis] * rhs[:, i - 1]
+
+        result = np.zeros_like(rhs)
+        result[:, -1] = rhs[:, -1] / diagonal[:, -1, np.newaxis]
+        for i in range(self.length - 2, -1, -1):
+            result[:, i] = (rhs[:, i] - upper[:, i, np.newaxis] * result[:, i + 1]) / diagonal[:, i, np.newaxis]
+
+        x[rows] = result[batch, position]
+
+    def solve_dense(self, group, coupled, b, x):
+        local = np.full(len(self.indices), -1, dtype=np.int64)
+        local[group] = np.arange(len(group))
+
+        matrix = np.eye(len(group))
+        rhs = b[group].copy()
+        for column in range(2):
+            other = self.neighbours[group, column]
+            inside = (other >= 0) & (local[np.maximum(other, 0)] >= 0)
+            rows = np.flatnonzero(inside)
+            np.add.at(matrix, (rows, local[other[inside]]), -coupled[group[inside], column])
+
+        try:
+            return np.linalg.solve(matrix, rhs)
+        except np.linalg.LinAlgError:
+            return x[group]
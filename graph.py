@@ -0,0 +1,154 @@
+import itertools
+import operator
+
+import numpy as np
+
+
+class VertGraph():
+    '''
+    Vertex adjacency of a mesh in compressed sparse row layout.
+    The neighbours of vert i are neighbours[offsets[i]:offsets[i+1]],
+    edge_index and edge_length hold the connecting edge at the same position.
+    '''
+
+    def __init__(self, co, edge_verts, topology=None):
+        co = np.asarray(co, dtype=np.float64).reshape(-1, 3)
+        edge_verts = np.asarray(edge_verts, dtype=np.int32).reshape(-1, 2)
+
+        # the element counts it was built for, see get_vert_graph
+        self.topology = topology
+        self.build = next(_builds)
+        self.vert_count = len(co)
+        self.edge_count = len(edge_verts)
+        self.edge_verts = edge_verts
+        self.co = co
+
+        source = np.concatenate((edge_verts[:, 0], edge_verts[:, 1]))
+        target = np.concatenate((edge_verts[:, 1], edge_verts[:, 0]))
+        edges = np.tile(np.arange(self.edge_count, dtype=np.int32), 2)
+
+        order = np.argsort(source, kind="stable")
+        self.neighbours = target[order]
+        self.edge_index = edges[order]
+
+        self.offsets = np.zeros(self.vert_count + 1, dtype=np.int32)
+        np.cumsum(np.bincount(source, minlength=self.vert_count), out=self.offsets[1:])
+
+        self.edge_length = self.edge_lengths(co)[self.edge_index]
+
+        self._views = None
+
+    @classmethod
+    def from_bmesh(cls, bm):
+        return cls(*read_bmesh(bm), topology=topology_key(bm))
+
+    def edge_lengths(self, co):
+        return np.linalg.norm(co[self.edge_verts[:, 0]] - co[self.edge_verts[:, 1]], axis=1)
+
+    def update_coordinates(self, co):
+        '''
+        Takes over moved coordinates of the same topology. Returns False if nothing moved.
+        '''
+        if np.array_equal(co, self.co):
+            return False
+
+        self.co = co
+        self.edge_length = self.edge_lengths(co)[self.edge_index]
+        self._views = None
+        return True
+
+    def views(self):
+        '''
+        Flat memoryviews of offsets, neighbours, edge lengths and coordinates.
+        Item access on these gives plain python numbers, which keeps the scalar search loops fast.
+        '''
+        if self._views is None:
+            self._views = (
+                memoryview(self.offsets),
+                memoryview(self.neighbours),
+                memoryview(self.edge_length),
+                memoryview(self.co.ravel()),
+            )
+        return self._views
+
+    def nbytes(self):
+        arrays = (self.co, self.edge_verts, self.offsets, self.neighbours, self.edge_index, self.edge_length)
+        return sum(a.nbytes for a in arrays)
+
+
+# numbers every built graph, a new one means the topology may have changed
+_builds = itertools.count()
+
+
+def read_coordinates(bm):
+    '''
+    Coordinates of all verts of the bmesh. Mapping the attribute lookups keeps the loop over the verts in C,
+    and nothing has to be flushed to the mesh first.
+    '''
+    values = itertools.chain.from_iterable(map(operator.attrgetter("co"), bm.verts))
+    return np.fromiter(values, dtype=np.float64, count=3 * len(bm.verts)).reshape(-1, 3)
+
+
+def read_edge_verts(bm):
+    bm.verts.index_update()
+    verts = itertools.chain.from_iterable(map(operator.attrgetter("verts"), bm.edges))
+    indices = map(operator.attrgetter("index"), verts)
+    return np.fromiter(indices, dtype=np.int32, count=2 * len(bm.edges)).reshape(-1, 2)
+
+
+def read_selected_verts(bm):
+    '''
+    Indices of all selected verts of the bmesh.
+    '''
+    select = np.fromiter(map(operator.attrgetter("select"), bm.verts), dtype=bool, count=len(bm.verts))
+    return np.flatnonzero(select).tolist()
+
+
+def read_bmesh(bm):
+    return read_coordinates(bm), read_edge_verts(bm)
+
+
+def topology_key(bm):
+    return (len(bm.verts), len(bm.edges), len(bm.faces))
+
+
+def is_path_current(bm, path):
+    '''
+    True if every two following verts of the path are still linked by an edge of the bmesh.
+    A graph is kept as long as the element counts match, so this catches the topology changes
+    which keep them, for the verts a search actually used.
+    '''
+    bm.verts.ensure_lookup_table()
+    verts = bm.verts
+    return all(bm.edges.get((verts[a], verts[b])) is not None for a, b in zip(path, path[1:]))
+
+
+_graphs = {}
+_max_cached_graphs = 4
+
+
+def get_vert_graph(obj, bm, rebuild=False):
+    '''
+    Returns the graph of the objects mesh. It is kept across operator calls as long as the element counts match,
+    see is_path_current for what that misses. Moved verts only update the coordinates and edge lengths.
+    rebuild: always build a new graph, after a path turned out to use edges which are gone.
+    '''
+    key = obj.data.as_pointer()
+    topology = topology_key(bm)
+
+    graph = _graphs.get(key)
+    if graph is not None and graph.topology == topology and not rebuild:
+        graph.update_coordinates(read_coordinates(bm))
+        return graph
+
+    graph = VertGraph(*read_bmesh(bm), topology=topology)
+    _graphs.pop(key, None)
+    _graphs[key] = graph
+    while len(_graphs) > _max_cached_graphs:
+        del _graphs[next(iter(_graphs))]
+
+    return graph
+
+
+def clear_cache():
+    _graphs.clear()
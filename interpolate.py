@@ -1,3 +1,4 @@
+import functools
 import numpy as np
 import math
 import mathutils
@@ -8,33 +9,30 @@ def catmullrom(P0, P1, P2, P3, a, nPoints=100):
     P0, P1, P2, and P3 should be (x,y,z) point pairs that define the Catmull-Rom spline.
     nPoints is the number of points to include in this curve segment.
     """
-    # Convert the points to numpy so that we can do array multiplication
-    P0, P1, P2, P3 = map(np.array, [P0, P1, P2, P3])
+    points = np.array([P0, P1, P2, P3], dtype=np.float64)[np.newaxis]
+    return catmullrom_batch(points, a, nPoints)[0]
 
-    # Calculate t0 to t4
-    alpha = a
 
-    def tj(ti, Pi, Pj):
-        xi, yi, zi = Pi
-        xj, yj, zj = Pj
+def catmullrom_batch(points, alpha, count=100):
+    '''
+    Evaluates many Catmull-Rom segments at once.
+    points: (N,4,3) control points, only the part between the 2nd and 3rd point is sampled
+    alpha: 0.5 is centripetal, 0 uniform and 1 chordal
+    :return: (N,count,3) array
+    '''
+    points = np.asarray(points, dtype=np.float64)
+    P0, P1, P2, P3 = (points[:, i, np.newaxis, :] for i in range(4))
 
-        # ( ( (xj-xi)**2 + (yj-yi)**2 )**0.5 )**alpha + ti
-        a = (xj - xi) ** 2 + (yj - yi) ** 2 + (zj - zi) ** 2
-        b = a ** 0.5
-        c = b ** alpha
-        return c + ti
+    def tj(ti, Pi, Pj):
+        return np.linalg.norm(Pj - Pi, axis=-1, keepdims=True) ** alpha + ti
 
-    t0 = 0
+    t0 = np.zeros(P0.shape[:-1] + (1,))
     t1 = tj(t0, P0, P1)
     t2 = tj(t1, P1, P2)
     t3 = tj(t2, P2, P3)
 
     # Only calculate points between P1 and P2
-    t = np.linspace(t1, t2, nPoints)
-
-    # Reshape so that we can multiply by the points P0 to P3
-    # and get a point for each value of t.
-    t = t.reshape(len(t), 1)
+    t = t1 + (t2 - t1) * np.linspace(0.0, 1.0, count)[np.newaxis, :, np.newaxis]
 
     A1 = (t1 - t) / (t1 - t0) * P0 + (t - t0) / (t1 - t0) * P1
     A2 = (t2 - t) / (t2 - t1) * P1 + (t - t1) / (t2 - t1) * P2
@@ -80,6 +78,59 @@ def hermite_3d(p1, p2, p3, p4, mu, tension, bias):
     return [x, y, z]
 
 
+def hermite_weights(mu, tension, bias):
+    '''
+    The hermite interpolation written as weights of the four control points, see hermite_1d.
+    mu: scalar or (M,) array, tension and bias: scalars or (N,) arrays for one value per segment
+    :return: (M,4) array, or (N,M,4) for per segment tension or bias
+    '''
+    mu = np.asarray(mu, dtype=np.float64)
+    tension = np.asarray(tension, dtype=np.float64)
+    bias = np.asarray(bias, dtype=np.float64)
+
+    if tension.ndim or bias.ndim:
+        tension = tension.reshape(-1, *([1] * mu.ndim))
+        bias = bias.reshape(-1, *([1] * mu.ndim))
+
+    mu2 = mu * mu
+    mu3 = mu2 * mu
+
+    a0 = 2 * mu3 - 3 * mu2 + 1
+    a1 = mu3 - 2 * mu2 + mu
+    a2 = mu3 - mu2
+    a3 = -2 * mu3 + 3 * mu2
+
+    c1 = (1 + bias) * (1 - tension) / 2
+    c2 = (1 - bias) * (1 - tension) / 2
+
+    return np.stack(np.broadcast_arrays(
+        -a1 * c1,
+        a0 + a1 * (c1 - c2) - a2 * c1,
+        a3 + a1 * c2 + a2 * (c1 - c2),
+        a2 * c2,
+    ), axis=-1)
+
+
+def bezier_weights(t):
+    '''
+    Cubic bernstein polynomials.
+    :return: (M,4) array
+    '''
+    t = np.asarray(t, dtype=np.float64)
+    u = 1 - t
+    return np.stack((u * u * u, 3 * u * u * t, 3 * u * t * t, t * t * t), axis=-1)
+
+
+@functools.lru_cache(maxsize=32)
+def hermite_table(count, tension, bias):
+    '''
+    Reusable weights for mu = i / count, i in range(count). Set Flow takes the row for mu = 0.5 of count 2.
+    '''
+    table = hermite_weights(np.arange(count) / float(count), tension, bias)
+    table.flags.writeable = False
+    return table
+
+
 def smooth_step(a, b, x):
     '''
     Perform Hermite interpolation between two values
@@ -87,6 +138,14 @@ def smooth_step(a, b, x):
 
     value = clamp((x - a) / (b - a))    
     return value * value * (3 - 2 * value)
+
+
+def smooth_step_batch(a, b, x):
+    '''
+    smooth_step for an array of values
+    '''
+    value = np.clip((np.asarray(x, dtype=np.float64) - a) / (b - a), 0.0, 1.0)
+    return value * value * (3 - 2 * value)
     
     
 def clamp(x, lowerlimit = 0.0, upperlimit = 1.0):
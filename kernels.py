@@ -0,0 +1,179 @@
+'''
+The array kernels of Set Flow. They only need NumPy, so this module also runs on its own as the worker
+process of FlowSystem.set_flow_processes, which can't import Blender modules.
+'''
+import pickle
+import sys
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+
+# columns of the stencil index arrays
+CENTER, P1, P2, P3_START, P3, P4 = range(6)
+
+# stencil codes, the curve runs into a boundary and the control point gets extrapolated
+EXTRAPOLATE_P1 = 1
+EXTRAPOLATE_P4 = 2
+
+
+def apply(co, indices, codes, weights, min_angle, relaxation=None):
+    '''
+    Moves the center of every stencil row onto the curve through its control points.
+    relaxation: optional factor per row, how much of the way there each center moves
+    '''
+    result, valid = evaluate(co, indices, codes, weights, min_angle)
+    centers = indices[valid, CENTER]
+    if relaxation is None:
+        co[centers] = result[valid]
+    else:
+        co[centers] += (result[valid] - co[centers]) * relaxation[valid, np.newaxis]
+
+
+def apply_active(co, indices, codes, weights, min_angle, changed=None, relaxation=None):
+    '''
+    apply restricted to the rows which read a changed vert, returns the number of evaluated rows.
+    changed: bool per vert, None evaluates all rows
+    '''
+    if changed is not None:
+        active = changed[indices].any(axis=1)
+        indices = indices[active]
+        codes = codes[active]
+        if relaxation is not None:
+            relaxation = relaxation[active]
+
+    if len(indices):
+        apply(co, indices, codes, weights, min_angle, relaxation)
+    return len(indices)
+
+
+def evaluate(co, indices, codes, weights, min_angle):
+    '''
+    Returns the new center positions and which rows have a valid curve.
+    '''
+    points = co[indices]
+    center = points[:, CENTER]
+    p2 = points[:, P2]
+    p3_start = points[:, P3_START]
+    p3 = points[:, P3]
+
+    has_p1 = ((codes & EXTRAPOLATE_P1) == 0)[:, np.newaxis]
+    has_p4 = ((codes & EXTRAPOLATE_P4) == 0)[:, np.newaxis]
+
+    p1 = np.where(has_p1, points[:, P1], p2 - (p3_start - p2))
+    p4 = np.where(has_p4, points[:, P4], p3 - (p2 - p3))
+
+    if min_angle > 0.0:
+        low = has_p1[:, 0] & (angle(p1 - p2, center - p2) < min_angle)
+        p1[low] = p2[low] - (p3_start[low] - p2[low]) * 0.5
+
+        low = has_p4[:, 0] & (angle(p4 - p3, center - p3) < min_angle)
+        p4[low] = p3[low] - (p2[low] - p3[low]) * 0.5
+
+    # two identical control points give no direction
+    valid = (p1 != p2).any(axis=1) & (p3 != p4).any(axis=1)
+
+    # normalize point distances so that long edges dont skew the curve
+    d = np.linalg.norm(p2 - p3, axis=1, keepdims=True) * 0.5
+    p1 = p2 + d * normalized(p1 - p2)
+    p4 = p3 + d * normalized(p4 - p3)
+
+    w1, w2, w3, w4 = weights
+    return p1 * w1 + p2 * w2 + p3 * w3 + p4 * w4, valid
+
+
+def normalized(vectors):
+    '''
+    Row wise normalize, zero length rows stay zero like mathutils does.
+    '''
+    length = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, length, out=np.zeros_like(vectors), where=length > 0.0)
+
+
+def angle(a, b):
+    dot = (normalized(a) * normalized(b)).sum(axis=1)
+    return np.arccos(np.clip(dot, -1.0, 1.0))
+
+
+def run_program(co, program, weights, min_angle, changed=None):
+    '''
+    One iteration given as (indices, codes, relaxation) steps in update order, see FlowSystem.program.
+    Returns the number of evaluated rows.
+    '''
+    return sum(apply_active(co, indices, codes, weights, min_angle, changed, relaxation)
+               for indices, codes, relaxation in program)
+
+
+def iterate(co, step, moved, iterations, tolerance, use_active_set=False, mixer=None):
+    '''
+    Repeats step(changed) until no moved vert moves further than tolerance, at most iterations times.
+    Returns the residual of every iteration and the number of evaluated rows, see FlowSystem.set_flow.
+    '''
+    changed = None
+    residuals = []
+    evaluations = 0
+    for i in range(iterations):
+        before = co[moved]
+        evaluations += step(changed)
+
+        distances = np.sqrt(((co[moved] - before) ** 2).sum(axis=1))
+        residual = float(distances.max()) if len(moved) else 0.0
+        residuals.append(residual)
+
+        if residual <= tolerance or i == iterations - 1:
+            break
+
+        # the last iteration is never mixed, so the result is always a plain update
+        if mixer is not None:
+            co[moved] = mixer.mix(before, co[moved])
+        elif use_active_set:
+            changed = np.zeros(len(co), dtype=bool)
+            changed[moved] = distances > tolerance
+
+    return residuals, evaluations
+
+
+def run_jobs(co, jobs, weights, min_angle, iterations, tolerance, use_active_set):
+    '''
+    Iterates every (program, moved) job on its own in place, returns residuals and evaluations per job.
+    '''
+    results = []
+    for program, moved in jobs:
+        def step(changed):
+            return run_program(co, program, weights, min_angle, changed)
+        results.append(iterate(co, step, moved, iterations, tolerance, use_active_set))
+    return results
+
+
+def attach(name):
+    '''
+    Opens the shared memory block of the parent. It stays owned by the parent, which unlinks it,
+    the resource tracker of a worker would remove it as soon as the worker exits.
+    '''
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # before python 3.13
+        memory = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(memory._name, "shared_memory")
+        return memory
+
+
+def main():
+    '''
+    Worker process: reads the shared memory name, the coordinate shape, the settings and the jobs from stdin,
+    runs them on the shared coordinates and writes the results of run_jobs to stdout.
+    '''
+    name, shape, settings, jobs = pickle.load(sys.stdin.buffer)
+    memory = attach(name)
+    try:
+        co = np.ndarray(shape, dtype=np.float64, buffer=memory.buf)
+        results = run_jobs(co, jobs, *settings)
+        del co
+    finally:
+        memory.close()
+    pickle.dump(results, sys.stdout.buffer)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import numpy as np
+
+
+class LandmarkIndex():
+    '''
+    Distances from a few landmark verts to all verts of a graph.VertGraph.
+    For any two verts a and b, |d(L, a) - d(L, b)| never exceeds the path length between them,
+    which gives A* much tighter lower bounds than the straight distance.
+
+    Topology distances only depend on the edges, so they stay valid until the topology changes.
+    Edge length distances are still usable after coordinates moved: a shortest path uses every edge
+    at most once, so no distance changed by more than the summed change of all edge lengths.
+    The bounds are lowered by this slack, until it grows too large compared to the distances.
+    Distances are kept in double precision like the path lengths of the search, rounding them down to
+    single precision could make a bound overestimate.
+    '''
+    max_slack = 0.1
+
+    def __init__(self, graph, use_topology_distance, count=8):
+        self.use_topology_distance = use_topology_distance
+        self.topology = topology_fingerprint(graph)
+
+        landmarks = []
+        distances = []
+        min_distances = shortest_distances(graph, 0, use_topology_distance)
+        for i in range(min(count, graph.vert_count)):
+            # farthest vert from all landmarks so far, unreachable ones first
+            candidate = int(np.argmax(min_distances))
+            if landmarks and candidate in landmarks:
+                break
+
+            distance = shortest_distances(graph, candidate, use_topology_distance)
+            landmarks.append(candidate)
+            distances.append(distance)
+            min_distances = distance if i == 0 else np.minimum(min_distances, distance)
+
+        self.landmarks = np.array(landmarks, dtype=np.int32)
+        self.distances = np.array(distances, dtype=np.float64).reshape(len(landmarks), graph.vert_count)
+        self.vert_count = graph.vert_count
+
+        self.edge_lengths = None
+        if not use_topology_distance:
+            self.edge_lengths = edge_lengths(graph)
+
+        finite = self.distances[np.isfinite(self.distances)]
+        self.mean_distance = float(finite.mean()) if len(finite) else 0.0
+
+        self.slack = 0.0
+        self._view = memoryview(self.distances.ravel())
+
+    def nbytes(self):
+        size = self.landmarks.nbytes + self.distances.nbytes
+        if self.edge_lengths is not None:
+            size += self.edge_lengths.nbytes
+        return size
+
+    def update(self, graph):
+        '''
+        Adapts the bounds to the current coordinates of the graph.
+        Returns False if the index has to be rebuilt.
+        '''
+        if topology_fingerprint(graph) != self.topology:
+            return False
+
+        if self.use_topology_distance:
+            return True
+
+        slack = float(np.abs(edge_lengths(graph) - self.edge_lengths).sum())
+        if slack > self.mean_distance * self.max_slack:
+            return False
+
+        self.slack = slack
+        return True
+
+    def estimator(self, target):
+        '''
+        Returns a function giving a lower bound of the distance from a vert to target.
+        '''
+        slack = self.slack
+        view = self._view
+        vert_count = self.vert_count
+
+        # landmarks in another component than the target tell nothing
+        active = []
+        for i in range(len(self.landmarks)):
+            to_target = view[i * vert_count + target]
+            if to_target != float("inf"):
+                active.append((i * vert_count, to_target))
+
+        def estimate(v):
+            best = 0.0
+            for offset, to_target in active:
+                bound = abs(to_target - view[offset + v])
+                if bound > best:
+                    best = bound
+            return max(best - slack, 0.0)
+
+        return estimate
+
+
+def topology_fingerprint(graph):
+    # the graph is only rebuilt for a new topology, its coordinates are updated in place
+    return (graph.vert_count, graph.edge_count, graph.build)
+
+
+def edge_lengths(graph):
+    lengths = np.zeros(graph.edge_count, dtype=np.float64)
+    lengths[graph.edge_index] = graph.edge_length
+    return lengths
+
+
+def shortest_distances(graph, source, use_topology_distance=False):
+    '''
+    Distances from one vert to all verts, inf for verts which can't be reached.
+    Whole frontiers are relaxed at once, a vert joins the next frontier whenever its distance improved.
+    '''
+    offsets = graph.offsets
+    neighbours = graph.neighbours
+    weights = None if use_topology_distance else graph.edge_length
+
+    distances = np.full(graph.vert_count, np.inf)
+    distances[source] = 0.0
+
+    frontier = np.array([source], dtype=np.int64)
+    while len(frontier):
+        starts = offsets[frontier].astype(np.int64)
+        counts = offsets[frontier + 1] - starts
+        total = int(counts.sum())
+        if total == 0:
+            break
+
+        first = np.cumsum(counts) - counts
+        slots = np.arange(total) - np.repeat(first - starts, counts)
+
+        targets = neighbours[slots]
+        candidates = np.repeat(distances[frontier], counts)
+        candidates += 1.0 if weights is None else weights[slots]
+
+        improved = candidates < distances[targets]
+        targets = targets[improved]
+        np.minimum.at(distances, targets, candidates[improved])
+
+        frontier = np.unique(targets).astype(np.int64)
+
+    return distances
+
+
+_indices = {}
+_max_cached_indices = 4
+
+
+def get_landmarks(obj, graph, use_topology_distance, count=8):
+    '''
+    Returns the landmark index of the objects mesh, it is kept across operator calls.
+    The index is rebuilt after topology changes, or when moved coordinates made its bounds too loose.
+    '''
+    key = (obj.data.as_pointer(), use_topology_distance)
+
+    index = _indices.get(key)
+    if index is not None and len(index.landmarks) >= min(count, graph.vert_count) and index.update(graph):
+        return index
+
+    index = LandmarkIndex(graph, use_topology_distance, count)
+    _indices.pop(key, None)
+    _indices[key] = index
+    while len(_indices) > _max_cached_indices:
+        del _indices[next(iter(_indices))]
+
+    return index
+
+
+def memory_usage():
+    '''
+    Bytes held by all cached landmark indices.
+    '''
+    return sum(index.nbytes() for index in _indices.values())
+
+
+def clear_cache():
+    _indices.clear()
@@ -27,6 +27,7 @@ class SetEdgeCurveOP(bpy.types.Operator, op_set_edge_flow.SetEdgeLoopBase):
     rail_end_width : FloatProperty(name="Rail End", default=1.0, subtype='DISTANCE', description="Choose how long the rail is at the end")
     rail_start_factor : FloatProperty(name="Rail Start", default=1.0, soft_min=0.0, soft_max=1.5, subtype='FACTOR', description="Choose how long the rail is at the start")
     rail_end_factor : FloatProperty(name="Rail End", default=1.0, soft_min=0.0, soft_max=1.5, subtype='FACTOR', description="Choose how long the rail is at the end")
+    tolerance : FloatProperty(name="Tolerance", default=0.0001, min=0.000001, soft_max=0.01, precision=6, subtype='DISTANCE', description="Maximum distance between the curve and the samples used to place the vertices along it")
    
     def execute(self, context):
         if not self.is_invoked:        
@@ -37,16 +38,15 @@ class SetEdgeCurveOP(bpy.types.Operator, op_set_edge_flow.SetEdgeLoopBase):
         refresh_positions = self.mix == self.last_mix
 
         if refresh_positions:
-            for obj in self.objects:            
-                for edgeloop in self.edgeloops[obj]:
-                    if self.rail_mode == 'ABSOLUTE':
-                        rail_start = self.rail_start_width    
-                        rail_end = self.rail_end_width
-                    else:
-                        rail_start = self.rail_start_factor
-                        rail_end = self.rail_end_factor
-
-                    edgeloop.set_curve_flow(self.tension / 100.0, self.use_rail, self.rail_mode, rail_start, rail_end)
+            if self.rail_mode == 'ABSOLUTE':
+                rail_start = self.rail_start_width
+                rail_end = self.rail_end_width
+            else:
+                rail_start = self.rail_start_factor
+                rail_end = self.rail_end_factor
+
+            for obj in self.objects:
+                self.loop_sets[obj].set_curve_flow(self.tension / 100.0, self.use_rail, self.rail_mode, rail_start, rail_end, self.tolerance)
                 
                 self.store_final_positions()
 
@@ -85,8 +85,11 @@ class SetEdgeCurveOP(bpy.types.Operator, op_set_edge_flow.SetEdgeLoopBase):
         
         sub_column.enabled = self.use_rail
 
+        column.separator()
+        column.prop(self, "tolerance")
+
     def invoke(self, context, event):
-        super(SetEdgeCurveOP, self).invoke(context)
+        super(SetEdgeCurveOP, self).invoke(context, event)
      
         if event and not event.alt:
             self.tension = 100
@@ -1,9 +1,23 @@
 import math
 import time
 import bpy
-from bpy.props import IntProperty, FloatProperty, EnumProperty
+import numpy as np
+from bpy.props import IntProperty, FloatProperty, EnumProperty, BoolProperty
 import bmesh
 from . import util
+from . import flow
+from . import edgeloop
+from . import topology
+
+
+def get_flow_workers(context):
+    '''
+    Threads or processes Set Flow may use, from the add-on preferences.
+    '''
+    addon = context.preferences.addons.get(__package__)
+    if addon is None:
+        return 1
+    return addon.preferences.flow_workers
 
 class SetEdgeLoopBase():
 
@@ -32,11 +46,10 @@ class SetEdgeLoopBase():
     def apply_mix(self):             
         if self.mix < 1.0 or (self.mix == 1.0 and self.last_mix < 1.0):
             for obj in self.objects:
-                for edgeloop in self.edgeloops[obj]:
-                    for vert in edgeloop.verts:
-                        a = self.intial_vert_positions[obj][vert.index]
-                        b = self.final_vert_positions[obj][vert.index]
-                        vert.co = a.lerp(b, self.mix)            
+                verts = self.bm[obj].verts
+                for index, a in self.intial_vert_positions[obj].items():
+                    b = self.final_vert_positions[obj][index]
+                    verts[index].co = a.lerp(b, self.mix)            
          
 
     @classmethod
@@ -51,8 +64,10 @@ class SetEdgeLoopBase():
     The base invoke stores affected objects, bmesh and intial vertex positions.
     The 'redo' calls by the undo system makes the bm invalid - so i have to look it up again...
     The storing of the intial vertex positions should only happen on the intial code path.  
+    The walked loops and the intial positions are kept per object in self.selections, so a redo only
+    rebinds them to the new bm. A real invoke (with an event) starts over.
     '''
-    def invoke(self, context):
+    def invoke(self, context, event=None):
         self.is_invoked = True
 
         self.last_mix = self.mix
@@ -60,40 +75,53 @@ class SetEdgeLoopBase():
         self.intial_vert_positions = {}
         self.final_vert_positions = {}
 
+        if event or getattr(self, "selections", None) is None:
+            self.selections = {}
 
         self.objects = set(context.selected_editable_objects) if context.selected_editable_objects else set([context.object])
         self.bm = {}
-        self.edgeloops = {}
-                
-        store_intial_positions = not self.intial_vert_positions
+        self.loop_sets = {}
 
         ignore = set()
         for obj in self.objects:
-            if obj.mode != 'EDIT':
+            if obj.mode != 'EDIT' or obj.data.total_edge_sel == 0:
                 ignore.add(obj)
                 continue
 
             bm = self.get_bm(obj)
-            edges = [e for e in bm.edges if e.select]
-            if len(edges) == 0:
-                ignore.add(obj)
-                continue
-
             self.bm[obj] = bm
-            edge_loops = util.get_edgeloops(bm, edges)
-            self.edgeloops[obj] = edge_loops
-
-            if store_intial_positions:
-                self.intial_vert_positions[obj] = {}
+            signature = self.selection_signature(obj, bm)
+
+            cached = self.selections.get(obj.name)
+            if cached is not None and cached[0] == signature:
+                _, loop_set, positions = cached
+                loop_set.rebind(bm)
+            else:
+                edges = [e for e in bm.edges if e.select]
+                edge_loops = util.get_edgeloops(bm, edges, topology.get_loop_index(obj, bm, edges))
+                loop_set = edgeloop.LoopSet(bm, edge_loops)
+
+                positions = {}
                 for e in edges:
                     for v in e.verts:
-                        if v.index not in self.intial_vert_positions[obj]:
+                        if v.index not in positions:
                             p = v.co.copy()
                             p = p.freeze()
-                            self.intial_vert_positions[obj][v.index] = p
+                            positions[v.index] = p
+                self.selections[obj.name] = (signature, loop_set, positions)
+
+            self.loop_sets[obj] = loop_set
+            self.intial_vert_positions[obj] = positions
 
         self.objects = self.objects - ignore
 
+    def selection_signature(self, obj, bm):
+        '''
+        Cheap stand-in for the selected loops. The undo system restores the mesh before every redo,
+        so as long as the counts match it is the selection the loops were walked for.
+        '''
+        return (len(bm.verts), len(bm.edges), len(bm.faces), obj.data.total_edge_sel)
+
 
 class SetEdgeFlowOP(bpy.types.Operator, SetEdgeLoopBase):
 
@@ -113,7 +141,11 @@ class SetEdgeFlowOP(bpy.types.Operator, SetEdgeLoopBase):
     )   
     
     tension: IntProperty(name="Tension", default=180, min=-500, max=500, description="Tension can be used to tighten up the curvature")    
-    iterations: IntProperty(name="Iterations", default=8, min=1, soft_max=32, description="How often the curveature operation is repeated")
+    iterations: IntProperty(name="Iterations", default=8, min=1, soft_max=32, description="How often the curveature operation is repeated at most")
+    solver: bpy.props.EnumProperty(name="Solver", items=flow.solvers, description="How the verts of neighbouring edgeloops are updated in each iteration, crossing edgeloops are always updated one after another")
+    tolerance: FloatProperty(name="Tolerance", default=0.0, min=0.0, soft_max=0.01, precision=6, subtype='DISTANCE', description="Stop iterating once no vertex moves further than this, zero always runs all iterations")
+    use_active_set: BoolProperty(name="Active Set", default=False, description="Only recompute vertices whose neighbourhood moved further than the tolerance in the last iteration")
+    acceleration: bpy.props.EnumProperty(name="Acceleration", items=flow.accelerations, description="Speeds up reaching the steady shape, this moves all vertices in every iteration so the active set is not used")
     
     blend_mode: bpy.props.EnumProperty(name="Blend Mode", items=blend_mode, description="Switch blend mode between absolute vertex counts and a factor of the whole edgeloop")
     blend_start_int: bpy.props.IntProperty(name="Blend Start", default=0, min=0, description="The number of vertices from the start of the loop used to blend to the adjusted loop position")
@@ -134,6 +166,12 @@ class SetEdgeFlowOP(bpy.types.Operator, SetEdgeLoopBase):
         column.prop(self, "tension")
         column.prop(self, "iterations")
         column.prop(self, "min_angle")
+        column.prop(self, "solver")
+        column.prop(self, "tolerance")
+        column.prop(self, "acceleration")
+        row = column.row()
+        row.prop(self, "use_active_set")
+        row.enabled = self.acceleration == 'NONE' and self.solver != 'DIRECT'
         column.separator()
 
         row = column.row()
@@ -158,24 +196,28 @@ class SetEdgeFlowOP(bpy.types.Operator, SetEdgeLoopBase):
         refresh_positions = self.mix == self.last_mix
         
         if refresh_positions:  
+            self.residuals = {}
+            self.evaluations = {}
+            self.thread_use = {}
+            self.workers = get_flow_workers(context)
             for obj in self.objects:
-                for i in range(self.iterations):
-                    for edgeloop in self.edgeloops[obj]:
-                        edgeloop.set_flow(tension=self.tension / 100.0,
-                                        min_angle=math.radians(self.min_angle))
-
-                for edgeloop in self.edgeloops[obj]:
-                    if self.blend_mode == 'ABSOLUTE':
-                        start = self.blend_start_int
-                        end = self.blend_end_int
-                    else:
-                        count = len(edgeloop.verts)
-                        start = round(count * self.blend_start_float)
-                        end = round(count * self.blend_end_float)
-                
-                    edgeloop.blend_start_end(blend_start=start, blend_end=end, blend_type=self.blend_type)
+                flowed, arc_lengths = self.get_flow_result(obj)
+
+                loop_set = self.loop_sets[obj]
+                if self.blend_mode == 'ABSOLUTE':
+                    start = self.blend_start_int
+                    end = self.blend_end_int
+                else:
+                    counts = loop_set.vert_counts()
+                    start = np.round(counts * self.blend_start_float)
+                    end = np.round(counts * self.blend_end_float)
+
+                loop_set.blend_start_end(blend_start=start, blend_end=end, blend_type=self.blend_type,
+                                         co=flowed, arc_lengths=arc_lengths)
         
             self.store_final_positions()
+            self.report_residuals()
+            self.report_thread_use()
 
         self.apply_mix()
 
@@ -188,13 +230,83 @@ class SetEdgeFlowOP(bpy.types.Operator, SetEdgeLoopBase):
         return {'FINISHED'}
 
 
+    def report_residuals(self):
+        '''
+        Iterations used, the largest vert move of the last one and the vertex evaluations.
+        The full history is kept in self.residuals.
+        '''
+        if self.tolerance <= 0.0 and not self.use_active_set:
+            return
+
+        for name, residuals in self.residuals.items():
+            if not residuals:
+                continue
+            state = "converged" if residuals[-1] <= self.tolerance else "stopped"
+            self.report({'INFO'}, "%s: %s after %s iterations, residual %.6f, %s vertex evaluations" % (
+                name, state, len(residuals), residuals[-1], self.evaluations[name]))
+
+
+    def report_thread_use(self):
+        for name, (parts, pool, speedup) in self.thread_use.items():
+            self.report({'INFO'}, "%s: %s independent parts on %s %s, %.2fx as fast as one thread" % (
+                name, parts, self.workers, pool, speedup))
+
+
+    def get_flow_result(self, obj):
+        '''
+        Positions of the loop verts after the flow and their arc lengths.
+        The blend settings don't change the flow, so a redo which only changes them
+        writes the cached result back and blends it again.
+        '''
+        if getattr(self, "flow_results", None) is None:
+            self.flow_results = {}
+
+        bm = self.bm[obj]
+        loop_set = self.loop_sets[obj]
+        settings = (self.tension, self.min_angle, self.iterations, self.solver, self.tolerance,
+                    self.use_active_set, self.acceleration)
+        key = self.selections[obj.name][0]
+
+        cached = self.flow_results.get(obj.name)
+        if cached is not None and cached[0] == settings and cached[1] == key:
+            _, _, flowed, arc_lengths, residuals, evaluations = cached
+            loop_set.write(bm, flowed, slice(None))
+        else:
+            residuals = loop_set.set_flow(tension=self.tension / 100.0,
+                                          min_angle=math.radians(self.min_angle),
+                                          iterations=self.iterations,
+                                          solver=self.solver,
+                                          tolerance=self.tolerance,
+                                          use_active_set=self.use_active_set,
+                                          acceleration=self.acceleration,
+                                          workers=self.workers)
+            system = loop_set.flow_system()
+            evaluations = system.evaluations
+            if system.parallel_parts:
+                self.thread_use[obj.name] = (system.parallel_parts, system.pool, system.speedup)
+
+            flowed = loop_set.read(bm)
+            arc_lengths = loop_set.arc_lengths(flowed)
+            self.flow_results[obj.name] = (settings, key, flowed, arc_lengths, residuals, evaluations)
+
+        self.residuals[obj.name] = residuals
+        self.evaluations[obj.name] = evaluations
+        return flowed, arc_lengths
+
     def invoke(self, context, event):
-        super(SetEdgeFlowOP, self).invoke(context)
+        super(SetEdgeFlowOP, self).invoke(context, event)
+
+        if event:
+            self.flow_results = {}
           
         if event and not event.alt:     
             self.mix = 1.0
             self.tension = 180
             self.iterations = 16           
+            self.solver = 'SEQUENTIAL'
+            self.tolerance = 0.0
+            self.use_active_set = False
+            self.acceleration = 'NONE'
             self.min_angle = 0
             self.blend_start_int = 0
             self.blend_end_int = 0
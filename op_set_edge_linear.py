@@ -14,22 +14,34 @@ class SetEdgeLinearOP(bpy.types.Operator, op_set_edge_flow.SetEdgeLoopBase):
 
     space_evenly: BoolProperty(name="Space evenly", default=False,
                                description="Spread the vertices in even distances")
+    distance: FloatProperty(name="Distance", default=0.0, min=0.0, subtype='DISTANCE',
+                            description="Distance of single edges to the vertices beyond them, at most half of the way between those. Zero keeps the distance every edge has")
+
+    def draw(self, context):
+        layout = self.layout
+        layout.use_property_split = True
+        column = layout.column(align=True)
+
+        column.prop(self, "mix")
+        if self.can_straighten():
+            column.prop(self, "distance")
+        else:
+            column.prop(self, "space_evenly")
 
     def invoke(self, context, event):
-        super(SetEdgeLinearOP, self).invoke(context)
+        super(SetEdgeLinearOP, self).invoke(context, event)
 
         if event and not event.alt:
             self.mix = 1.0
+            self.distance = 0.0
 
         return self.execute(context)
 
     def can_straighten(self):
-        for obj in self.objects:
-            for edgeloop in self.edgeloops[obj]:
-                if len(edgeloop.edges) != 1:
-                    return False
-
-        return True
+        '''
+        Only single edges are selected, they get straightened between their neighbours instead.
+        '''
+        return all(self.loop_sets[obj].can_straighten() for obj in self.objects)
 
     def execute(self, context):
         if not self.is_invoked:
@@ -40,9 +52,13 @@ class SetEdgeLinearOP(bpy.types.Operator, op_set_edge_flow.SetEdgeLoopBase):
         refresh_positions = self.mix == self.last_mix
 
         if refresh_positions:
+            straighten = self.can_straighten()
             for obj in self.objects:
-                for edgeloop in self.edgeloops[obj]:
-                    edgeloop.set_linear(self.space_evenly)
+                if straighten:
+                    loop_set = self.loop_sets[obj]
+                    loop_set.straighten(self.distance if self.distance > 0.0 else loop_set.straighten_gaps())
+                else:
+                    self.loop_sets[obj].set_linear(self.space_evenly)
             self.store_final_positions()
 
         self.apply_mix()
@@ -4,69 +4,58 @@ import bpy
 from bpy.props import IntProperty, FloatProperty, BoolProperty
 import bmesh
 import mathutils
+import numpy as np
 
 from . import interpolate
+from . import arclength
 from . import dijkstra
+from . import graph
+from . import landmarks
+from . import util
 
 
-def collect_vert_path(bm, selected, use_topology_distance):
+def collect_vert_path(bm, selected, use_topology_distance, goal_directed=True, stats=None, vert_graph=None, selected_verts=None, landmarks=None):
     '''
     Find the shortest paths from the selected verts this is based on input order.
     [a,b,c] -> ([a,b],[b,c])
-    '''
-    current = len(selected) - 1
-
-    path = []
-    while current > 0:
-        start = bm.verts[selected[current]]
-        end = bm.verts[selected[current-1]]
-
-        current -= 1
-
-        nodes = dijkstra.find_path(
-            bm, start, end, use_topology_distance=use_topology_distance)
-        path.append((start, end, nodes))
+    Returns the joined vert path and the positions of the selected verts inside of it.
 
-    vert_path = []
-    for p in path:
-        start, end, nodes = p
-        node = nodes[end]
+    Before searching, the path is taken from the selection if all selected_verts form a chain through the knots,
+    and a pair of knots on the same edge loop is connected along that loop, unless the search finds a shorter path.
+    '''
+    if vert_graph is None:
+        vert_graph = graph.VertGraph.from_bmesh(bm)
 
-        start_end_path = node.shortest_path
+    if selected_verts is not None:
+        chain = dijkstra.find_chain(vert_graph, selected_verts, selected)
+        if chain is not None:
+            path, boundaries = chain
+            return [bm.verts[v] for v in path], boundaries
 
-        if start not in vert_path:
-            vert_path.append(start)
+    def follow_edge_loop(start, target):
+        verts = util.walk_vert_loop(bm.verts[start], bm.verts[target], use_topology_distance)
+        if verts is None:
+            return None
+        return [v.index for v in verts]
 
-        for e in start_end_path:
-            if e.verts[0] not in vert_path:
-                vert_path.append(e.verts[0])
-            elif e.verts[1] not in vert_path:
-                vert_path.append(e.verts[1])
+    path, boundaries = dijkstra.find_paths(
+        vert_graph, selected, use_topology_distance=use_topology_distance,
+        goal_directed=goal_directed, stats=stats, shortcut=follow_edge_loop, landmarks=landmarks)
 
-    vert_path = list(reversed(vert_path))
-    return vert_path
+    vert_path = [bm.verts[v] for v in path]
+    return vert_path, boundaries
 
 
-def split_vert_path_into_segments(bm, selected, vert_path):
+def split_vert_path_into_segments(vert_path, boundaries):
     '''
-    Splits the vert path into segments based on selected vertices
+    Splits the vert path into segments based on the positions of the selected vertices
     selected [a1,b1,c1,d1] vert_path[a1, a2, a3, b, b2, c1, c2, c3, d1] -> [a1,b1,c1,d1], ([a1,a2,a3,b], [b1,b2,c], [c1,c2,3,d])
     '''
-    knots = []
-    segments = [[]]
-
-    for v in vert_path:
-        current_knot_index = len(knots)
-        current_knot = bm.verts[selected[current_knot_index]]
+    knots = [vert_path[b] for b in boundaries]
+    segments = [vert_path[a:b+1] for a, b in zip(boundaries, boundaries[1:])]
 
-        if v == current_knot:
-            knots.append(current_knot)
-            segments[-1].append(v)
-
-            if current_knot_index != 0 and current_knot_index != len(selected)-1:
-                segments.append([v])
-        else:
-            segments[-1].append(v)
+    if not segments:
+        segments = [vert_path[:]]
 
     return knots, segments
 
@@ -75,43 +64,34 @@ def map_segment_onto_spline(segment, positions):
     '''
     Calculates the total arc length, and evenly distributes the points based on this.
     '''
+    map_segments_onto_splines([segment], [positions])
 
-    if len(segment) == 1:
-        return
-
-    total_lenght = 0
-    for index in range(1, len(positions)):
-        total_lenght += (positions[index] - positions[index-1]).magnitude
-
-    segment_part_length = total_lenght / float(len(segment)-1)
-
-    current_segment_index = 1
-    current_length = 0
-    for index in range(1, len(positions)):
-        current_length += (positions[index] - positions[index-1]).magnitude
-        if current_length >= segment_part_length:
 
-            remainder = current_length - segment_part_length
-            current_length = current_length % segment_part_length
-
-            p1 = positions[index-1]
-            p2 = positions[index]
-            p = p1 + (p1-p2).normalized() * remainder
+def map_segments_onto_splines(segments, splines):
+    '''
+    Distributes the verts of every segment evenly along its spline, given as polyline.
+    All segments are resampled together, the end verts of the segments stay where they are.
+    '''
+    pairs = [(segment, spline) for segment, spline in zip(segments, splines) if len(segment) > 2]
+    if not pairs:
+        return
 
-            if current_segment_index != 0 and current_segment_index != len(segment)-1:
-                v = segment[current_segment_index]
-                v.co = p
+    segments = [segment for segment, _ in pairs]
+    splines = [np.asarray(spline, dtype=np.float64).reshape(-1, 3) for _, spline in pairs]
+    positions = arclength.resample_polylines(splines, [len(segment) for segment in segments])
 
-                current_segment_index += 1
+    for segment, segment_positions in zip(segments, positions):
+        for vert, position in zip(segment[1:-1], segment_positions[1:-1].tolist()):
+            vert.co = position
 
 
-def curve_hermite(bm, selected, vert_path, tension, space_evenly):
-    knots, segments = split_vert_path_into_segments(bm, selected, vert_path)
+def curve_hermite(bm, selected, vert_path, boundaries, tension, space_evenly, tolerance):
+    knots, segments = split_vert_path_into_segments(vert_path, boundaries)
 
     if len(knots) == 1:
         return 1, 'Path found is too short - try toggling "Edge Distance"'
 
-    total_spline = []
+    controls = []
     for index, segment in enumerate(segments):
         is_start = index == 0
         is_end = index == len(segments)-1
@@ -160,30 +140,27 @@ def curve_hermite(bm, selected, vert_path, tension, space_evenly):
                     break
             p3 = p3.vert.co
 
-        bias = 0
-        spline_points = []
-        precision = 1000
-        for i in range(precision):
-            mu = i / float(precision)
-            spline_pos = interpolate.hermite_3d(
-                p0, p1, p2, p3, mu, -tension, bias)
-            v = mathutils.Vector(spline_pos)
-            spline_points.append(v)
-
-        if not space_evenly:
-            map_segment_onto_spline(segment, spline_points)
-        else:
-            total_spline.extend(spline_points)
+        controls.append((p0[:], p1[:], p2[:], p3[:]))
 
-    if space_evenly:
-        map_segment_onto_spline(vert_path, total_spline)
+    # all segments are sampled in one go, only as fine as the tolerance needs
+    bias = 0
+
+    def basis(mu):
+        return interpolate.hermite_weights(mu, -tension, bias)
+
+    splines = arclength.flatten(arclength.spline(controls, basis), len(controls), tolerance)
+
+    if not space_evenly:
+        map_segments_onto_splines(segments, splines)
+    else:
+        map_segment_onto_spline(vert_path, arclength.join(splines))
 
     return 0, ""
 
 
-def curve_bezier(bm, selected, vert_path):
+def curve_bezier(bm, selected, vert_path, boundaries):
 
-    knots, segments = split_vert_path_into_segments(bm, selected, vert_path)
+    knots, segments = split_vert_path_into_segments(vert_path, boundaries)
 
     for index, segment in enumerate(segments):
 
@@ -295,8 +272,8 @@ def curve_bezier(bm, selected, vert_path):
         return 0
 
 
-def circle_3_points(bm, selected, vert_path, tension, space_evenly):
-    knots, segments = split_vert_path_into_segments(bm, selected, vert_path)
+def circle_3_points(bm, selected, vert_path, boundaries, tension, space_evenly, tolerance):
+    knots, segments = split_vert_path_into_segments(vert_path, boundaries)
 
     vert_a = knots[0]
     vert_b = knots[1]
@@ -308,13 +285,8 @@ def circle_3_points(bm, selected, vert_path, tension, space_evenly):
 
     # If tension is zero, use linear interpolation
     if tension == -1.0:
-        positions = []
-        samples = len(vert_path)*100
-        for sample in range(samples):
-            mu = sample / samples
-            positions.append(a.lerp(c, mu))
-        
-        map_segment_onto_spline(vert_path, positions)
+        # a straight line needs no samples in between
+        map_segment_onto_spline(vert_path, [a, c])
         return 0, ""
 
 
@@ -347,8 +319,8 @@ def circle_3_points(bm, selected, vert_path, tension, space_evenly):
 
     if space_evenly:
         positions = []
-        samples = len(vert_path)*100
-        for sample in range(samples):
+        samples = arc_samples(start, middle, end, radius, tolerance)
+        for sample in range(samples + 1):
             mu = sample / samples
             if mu <= 0.5:
                 interpolated = start.slerp(middle, mu * 2.0)
@@ -377,7 +349,7 @@ def circle_3_points(bm, selected, vert_path, tension, space_evenly):
     return 0, ""
 
 
-def circle_2_points(bm, selected, vert_path, tension, flip, rotate):
+def circle_2_points(bm, selected, vert_path, boundaries, tension, flip, rotate, tolerance):
     '''
     Spaces the vertices into a half circle between two points, orientation is based on the topology of the first vert
     '''
@@ -391,13 +363,8 @@ def circle_2_points(bm, selected, vert_path, tension, flip, rotate):
 
     # If tension is zero, use linear interpolation
     if tension == 0.0:
-        positions = []
-        samples = len(vert_path)*100
-        for sample in range(samples):
-            mu = sample / samples
-            positions.append(a.lerp(c, mu))
-        
-        map_segment_onto_spline(vert_path, positions)
+        # a straight line needs no samples in between
+        map_segment_onto_spline(vert_path, [a, c])
         return 0, ""
 
 
@@ -438,8 +405,8 @@ def circle_2_points(bm, selected, vert_path, tension, flip, rotate):
     radius = (a - center).magnitude
     
     positions = []
-    samples = len(vert_path)*100
-    for sample in range(samples):
+    samples = arc_samples(start, middle, end, radius, tolerance)
+    for sample in range(samples + 1):
         mu = sample / samples
 
         if mu <= 0.5:
@@ -456,6 +423,61 @@ def circle_2_points(bm, selected, vert_path, tension, flip, rotate):
     return 0, ""
 
 
+def arc_samples(start, middle, end, radius, tolerance):
+    '''
+    Sample count for the two halves of the circles, the larger arc decides how fine both are sampled.
+    '''
+    angle = max(start.angle(middle, 0.0), middle.angle(end, 0.0))
+    return 2 * (arclength.arc_samples(radius, angle, tolerance) - 1)
+
+
+class VertCurveCache():
+    '''
+    Keeps the vert path and the computed curves between the redo calls of the operator.
+    The path is reused as long as the selection, the distance mode and the element counts stay the same
+    and its verts are still linked and where the path was found, which is what a redo restores.
+    Curves are stored per curve setting so a change of the mix is only a lerp.
+    '''
+    max_curves = 32
+
+    def __init__(self):
+        self.path_key = None
+        self.path = []
+        self.boundaries = []
+        self.initial_positions = None
+        self.curves = {}
+
+    def has_path(self, path_key, bm):
+        if self.path_key != path_key:
+            return False
+
+        # a repeat starts from the curved verts, the path has to be searched again
+        vert_path = self.get_vert_path(bm)
+        positions = np.array([v.co for v in vert_path], dtype=np.float64).reshape(-1, 3)
+        return np.array_equal(positions, self.initial_positions) and graph.is_path_current(bm, self.path)
+
+    def set_path(self, path_key, vert_path, boundaries):
+        self.path_key = path_key
+        self.path = [v.index for v in vert_path]
+        self.boundaries = boundaries
+        self.initial_positions = np.array([v.co for v in vert_path], dtype=np.float64).reshape(-1, 3)
+        self.curves = {}
+
+    def get_vert_path(self, bm):
+        return [bm.verts[i] for i in self.path]
+
+    def get_curve(self, curve_key):
+        return self.curves.get(curve_key)
+
+    def set_curve(self, curve_key, vert_path, result, msg):
+        if len(self.curves) >= self.max_curves:
+            del self.curves[next(iter(self.curves))]
+
+        positions = np.array([v.co for v in vert_path], dtype=np.float64).reshape(-1, 3)
+        self.curves[curve_key] = (positions, result, msg)
+        return self.curves[curve_key]
+
+
 '''
 
 OPERATOR
@@ -481,12 +503,18 @@ class SetVertexCurveOp(bpy.types.Operator):
                          description="Tension can be used to tighten up the curvature")
     use_topology_distance: BoolProperty(name="Use Topology Distance", default=False,
                                         description="Use the edge count instead of edge lengths for distance measure")
+    use_goal_directed_search: BoolProperty(name="Goal Directed Search", default=True,
+                                           description="Search the path towards the target vertex instead of evenly in all directions")
+    use_landmarks: BoolProperty(name="Use Landmarks", default=False,
+                                description="Precompute distances to a few landmark vertices once per mesh, this speeds up repeated path searches on the same dense mesh")
     flip: BoolProperty(name="Flip Half Circle", default=False,
                        description="Flip the half circle into other direction")
     rotate: BoolProperty(name="Rotate Half Circle", default=False,
                        description="Rotate the half circle by 90 degrees")
     space_evenly: BoolProperty(name="Space evenly", default=False,
                                description="Spread the vertices in even distances")
+    tolerance: FloatProperty(name="Tolerance", default=0.0001, min=0.000001, soft_max=0.01, precision=6, subtype='DISTANCE',
+                             description="Maximum distance between the curve and the samples used to place the vertices along it")
 
     def draw(self, context):
         layout = self.layout
@@ -498,6 +526,7 @@ class SetVertexCurveOp(bpy.types.Operator):
         column = layout.column(align=True)
         column.prop(self, "tension")
         column.prop(self, "use_topology_distance")
+        column.prop(self, "use_landmarks")
 
         if self.vert_count == 2:
             column.prop(self, "flip")
@@ -505,6 +534,8 @@ class SetVertexCurveOp(bpy.types.Operator):
         if self.vert_count >= 3:
             column.prop(self, "space_evenly")
 
+        column.prop(self, "tolerance")
+
     @classmethod
     def poll(cls, context):
         if (context.space_data.type == 'VIEW_3D'
@@ -522,6 +553,20 @@ class SetVertexCurveOp(bpy.types.Operator):
         bm.verts.ensure_lookup_table()
         return bm
 
+    def find_vert_path(self, obj, bm, selected, rebuild=False):
+        vert_graph = graph.get_vert_graph(obj, bm, rebuild)
+        landmark_index = None
+        if self.use_landmarks:
+            landmark_index = landmarks.get_landmarks(obj, vert_graph, self.use_topology_distance)
+            self.report({'INFO'}, "Landmarks: %s verts, %.2f MB cached" % (
+                len(landmark_index.landmarks), landmarks.memory_usage() / 1024 ** 2))
+
+        return collect_vert_path(bm, selected, self.use_topology_distance,
+                                 goal_directed=self.use_goal_directed_search,
+                                 vert_graph=vert_graph,
+                                 selected_verts=graph.read_selected_verts(bm),
+                                 landmarks=landmark_index)
+
     def get_selected(self, bm):
         maybe_selected = [elem.index for elem in bm.select_history if isinstance(
             elem, bmesh.types.BMVert)]
@@ -532,7 +577,7 @@ class SetVertexCurveOp(bpy.types.Operator):
     def invoke(self, context, event):
         # print ("-" * 66)
         
-        self.intial_vert_positions = []
+        self.cache = VertCurveCache()
         self.vert_count = 0
 
         if event and not event.alt:
@@ -555,29 +600,53 @@ class SetVertexCurveOp(bpy.types.Operator):
             return {'CANCELLED'}
         # print ("#" * 66)
 
-        vert_path = collect_vert_path(bm, selected, self.use_topology_distance)
-
-        if len(self.intial_vert_positions) == 0:
-            for vert in vert_path:
-                self.intial_vert_positions.append(vert.co.copy())
+        if getattr(self, "cache", None) is None:
+            self.cache = VertCurveCache()
 
-        tension = self.tension / 100.0
+        # a redo restores the mesh first, so the path stays valid for the same selection and element counts,
+        # has_path only checks the path verts. The graph is only needed on a miss.
+        path_key = (tuple(selected), self.use_topology_distance, self.use_goal_directed_search,
+                    self.use_landmarks, len(bm.verts), len(bm.edges))
 
-        if len(selected) == 2:
-            result, msg = circle_2_points(
-                bm, selected, vert_path, tension, self.flip, self.rotate)
-        elif len(selected) == 3:
-            result, msg = circle_3_points(
-                bm, selected, vert_path, tension, self.space_evenly)
+        if self.cache.has_path(path_key, bm):
+            vert_path = self.cache.get_vert_path(bm)
         else:
-            result, msg = curve_hermite(
-                bm, selected, vert_path, tension, self.space_evenly)
+            vert_path, boundaries = self.find_vert_path(context.object, bm, selected)
+
+            # the cached graph only knows the element counts, a path over edges which are gone means it is stale
+            if not graph.is_path_current(bm, [v.index for v in vert_path]):
+                vert_path, boundaries = self.find_vert_path(context.object, bm, selected, rebuild=True)
+
+            self.cache.set_path(path_key, vert_path, boundaries)
+
+        boundaries = self.cache.boundaries
+
+        curve_key = (self.tension, self.flip, self.rotate, self.space_evenly, self.tolerance)
+        curve = self.cache.get_curve(curve_key)
+
+        if curve is None:
+            tension = self.tension / 100.0
+
+            if len(selected) == 2:
+                result, msg = circle_2_points(
+                    bm, selected, vert_path, boundaries, tension, self.flip, self.rotate, self.tolerance)
+            elif len(selected) == 3:
+                result, msg = circle_3_points(
+                    bm, selected, vert_path, boundaries, tension, self.space_evenly, self.tolerance)
+            else:
+                result, msg = curve_hermite(
+                    bm, selected, vert_path, boundaries, tension, self.space_evenly, self.tolerance)
+
+            curve = self.cache.set_curve(curve_key, vert_path, result, msg)
 
+        final_positions, result, msg = curve
         if result > 0:
             self.report({'INFO'}, msg)
 
-        for i, vert in enumerate(vert_path):
-            vert.co = self.intial_vert_positions[i].lerp(vert.co, self.mix)
+        initial_positions = self.cache.initial_positions
+        positions = initial_positions + (final_positions - initial_positions) * self.mix
+        for vert, position in zip(vert_path, positions):
+            vert.co = position
 
         bmesh.update_edit_mesh(context.object.data, loop_triangles=True)
 
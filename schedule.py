@@ -0,0 +1,84 @@
+import numpy as np
+
+from . import topology
+
+
+class RingGraph():
+    '''
+    Edge loops as nodes, linked when the flow of one loop reads or moves a vert the other one moves.
+    That are the loops beside it along its edge rings, up to the second ring step where p1 and p4 come from,
+    and loops crossing it. In CSR form: the loops linked to loop i are neighbours[offsets[i]:offsets[i + 1]].
+    '''
+
+    def __init__(self, count, pairs):
+        pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+        pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+        pairs = np.unique(np.concatenate((pairs, pairs[:, ::-1])), axis=0)
+
+        self.count = count
+        self.offsets = np.zeros(count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pairs[:, 0], minlength=count), out=self.offsets[1:])
+        self.neighbours = pairs[:, 1].astype(np.int32)
+
+    def __len__(self):
+        return self.count
+
+    def nbytes(self):
+        return self.offsets.nbytes + self.neighbours.nbytes
+
+    def linked(self, loop):
+        return self.neighbours[self.offsets[loop]:self.offsets[loop + 1]]
+
+    def pairs(self):
+        loops = np.repeat(np.arange(self.count), np.diff(self.offsets))
+        return np.stack((loops, self.neighbours), axis=1)
+
+
+class Schedule():
+    '''
+    The order loops of a RingGraph are processed in.
+
+    order: loops by descending max valence, ties keep their order. Updating loop after loop in this order
+           is the in place (Gauss-Seidel) update of Set Flow.
+    batches: a greedy coloring along the order, loops of one batch are never linked and can be updated together.
+    components: loops linked through any chain, each in the order. Loops of different components never see
+                each others moves, so the components can be processed separately.
+    '''
+
+    def __init__(self, graph, priorities):
+        priorities = np.asarray(priorities, dtype=np.int64)
+        self.graph = graph
+        self.order = np.argsort(-priorities, kind="stable")
+
+        self.colors = color_loops(graph, self.order)
+        ordered_colors = self.colors[self.order]
+        self.batches = [self.order[ordered_colors == color] for color in range(int(self.colors.max(initial=-1)) + 1)]
+
+        # components are numbered by their first loop in the order
+        labels = topology.components(len(graph), graph.pairs())[self.order]
+        _, first, inverse = np.unique(labels, return_index=True, return_inverse=True)
+        rank = np.argsort(np.argsort(first))[inverse]
+        self.component = np.zeros(len(graph), dtype=np.int32)
+        self.component[self.order] = rank
+
+        grouped = self.order[np.argsort(rank, kind="stable")]
+        self.components = np.split(grouped, np.cumsum(np.bincount(rank))[:-1]) if len(grouped) else []
+
+    def nbytes(self):
+        size = self.graph.nbytes() + self.order.nbytes + self.colors.nbytes + self.component.nbytes
+        return size + sum(b.nbytes for b in self.batches) + sum(c.nbytes for c in self.components)
+
+
+def color_loops(graph, order):
+    offsets = graph.offsets.tolist()
+    neighbours = graph.neighbours.tolist()
+
+    colors = [-1] * len(graph)
+    for loop in order.tolist():
+        used = {colors[other] for other in neighbours[offsets[loop]:offsets[loop + 1]]}
+        color = 0
+        while color in used:
+            color += 1
+        colors[loop] = color
+
+    return np.array(colors, dtype=np.int32)
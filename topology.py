@@ -0,0 +1,318 @@
+import numpy as np
+
+
+class LoopIndex():
+    '''
+    Edge loops and edge rings of a whole mesh as integer arrays, built in one pass over the bmesh.
+
+    Loops follow the same step as util.walk_edge_loop: through a valence 4 vert onto the edge across it.
+    Two edges are only linked if the step leads back as well and both edges would be walked that way,
+    boundary edges and edges along ngons without quad flow are left to the other util walkers.
+    edge_loop[e] is the loop of edge e and edge_position[e] its place in it, -1 for edges without a loop.
+    irregular marks edges where util.walk_edge_loop would step to an edge which isn't linked.
+
+    The verts of loop i are loop_verts[loop_offsets[i]:loop_offsets[i + 1]] in loop order,
+    a cyclic loop repeats its first vert. edge_ring[e] labels the edge rings, edges across a quad share it.
+    '''
+
+    def __init__(self, bm, key=None):
+        self.key = key
+
+        bm.verts.index_update()
+        bm.edges.index_update()
+        edges = bm.edges
+        edge_count = len(edges)
+
+        edge_verts = np.zeros((edge_count, 2), dtype=np.int32)
+        walkable = np.zeros(edge_count, dtype=bool)
+        steps = np.full((edge_count, 2), -1, dtype=np.int64)
+        crowded = np.zeros(edge_count, dtype=bool)
+        ring_pairs = []
+
+        for e in edges:
+            i = e.index
+            edge_verts[i], walkable[i], steps[i], crowded[i] = edge_record(e)
+
+            for loop in e.link_loops:
+                if len(loop.face.verts) == 4:
+                    ring_pairs.append((i, loop.link_loop_next.link_loop_next.edge.index))
+
+        # a step is a link if the edge across steps back through the same vert
+        own = np.arange(edge_count)[:, np.newaxis]
+        other = np.maximum(steps, 0)
+        back_slot = np.where(edge_verts[other, 0] == edge_verts, 0, 1)
+        links = (steps >= 0) & (steps != own) & (steps[other, back_slot] == own)
+        links &= walkable[:, np.newaxis] & walkable[other]
+        links[crowded] = False
+        self.links = np.where(links, steps, -1)
+        self.irregular = ((steps >= 0) & ~links).any(axis=1) | crowded
+
+        self.edge_verts = edge_verts
+        self.walkable = walkable
+        self.steps = steps.astype(np.int32)
+        self.crowded = crowded
+        self.walk_loops(walkable)
+        self.edge_ring = components(edge_count, np.array(ring_pairs, dtype=np.int64).reshape(-1, 2))
+
+    def walk_loops(self, walkable):
+        '''
+        Orders the linked edges into loops, open ones are walked from an end, the rest are cycles.
+        '''
+        links = self.links.tolist()
+        edge_verts = self.edge_verts.tolist()
+        edge_count = len(links)
+
+        edge_loop = [-1] * edge_count
+        edge_position = [-1] * edge_count
+        loop_verts = []
+        loop_sizes = []
+        cyclic = []
+
+        degree = (self.links >= 0).sum(axis=1)
+        ends = np.flatnonzero(walkable & (degree < 2)).tolist()
+        rest = np.flatnonzero(walkable & (degree == 2)).tolist()
+
+        for start in ends + rest:
+            if edge_loop[start] != -1:
+                continue
+
+            loop = len(loop_sizes)
+            # leave through the linked side, an open loop starts with the vert of its free side
+            side = 1 if links[start][1] != -1 else 0
+            verts = [edge_verts[start][1 - side]]
+
+            edge, previous = start, -1
+            position = 0
+            is_cyclic = False
+            while True:
+                edge_loop[edge] = loop
+                edge_position[edge] = position
+                position += 1
+
+                v0, v1 = edge_verts[edge]
+                verts.append(v1 if v0 == verts[-1] else v0)
+
+                following = [n for n in links[edge] if n != -1 and n != previous]
+                if previous == -1 and edge == start:
+                    following = [links[start][side]] if links[start][side] != -1 else []
+                if not following:
+                    break
+
+                previous, edge = edge, following[0]
+                if edge_loop[edge] == loop:
+                    is_cyclic = True
+                    break
+
+            loop_verts.extend(verts)
+            loop_sizes.append(len(verts))
+            cyclic.append(is_cyclic)
+
+        self.edge_loop = np.array(edge_loop, dtype=np.int32)
+        self.edge_position = np.array(edge_position, dtype=np.int32)
+        self.loop_verts = np.array(loop_verts, dtype=np.int32)
+        self.loop_offsets = np.zeros(len(loop_sizes) + 1, dtype=np.int64)
+        np.cumsum(loop_sizes, out=self.loop_offsets[1:])
+        self.loop_cyclic = np.array(cyclic, dtype=bool)
+
+    def __len__(self):
+        return len(self.loop_cyclic)
+
+    def nbytes(self):
+        arrays = (self.edge_verts, self.links, self.irregular, self.walkable, self.steps, self.crowded,
+                  self.edge_loop, self.edge_position, self.edge_ring, self.loop_verts, self.loop_offsets, self.loop_cyclic)
+        return sum(a.nbytes for a in arrays)
+
+    def loop_edge_counts(self):
+        return np.diff(self.loop_offsets) - 1
+
+    def is_current(self, bm, edge_indices):
+        '''
+        Compares the given edges and the edges they step to with the bmesh. Runs only depend on these,
+        so this notices the topology changes which keep the element counts, without looking at the whole mesh.
+        '''
+        selected = np.asarray(edge_indices, dtype=np.int64)
+        if len(selected) and (selected.max() >= len(self.edge_loop)):
+            return False
+
+        steps = self.steps[selected].ravel()
+        checked = np.union1d(selected, steps[steps >= 0])
+
+        bm.edges.ensure_lookup_table()
+        edges = bm.edges
+        indexed = zip(checked.tolist(), self.edge_verts[checked].tolist(), self.walkable[checked].tolist(),
+                      self.steps[checked].tolist(), self.crowded[checked].tolist())
+        for i, edge_verts, walkable, steps, crowded in indexed:
+            if edge_record(edges[i]) != (tuple(edge_verts), walkable, tuple(steps), crowded):
+                return False
+
+        return True
+
+    def selection_runs(self, edge_indices):
+        '''
+        Splits selected edges into runs of consecutive edges along the indexed loops, each in loop order.
+        Runs with an irregular edge and edges without a loop are returned separately for the util walkers,
+        together with every run they share a vert with, directly or through other runs. The walkers then
+        never meet an edge of a returned run and walk the rest the same way they walk a whole selection.
+        '''
+        selected = np.asarray(edge_indices, dtype=np.int64)
+        indexed = self.edge_loop[selected] >= 0
+        rest = selected[~indexed].tolist()
+        selected = selected[indexed]
+        if len(selected) == 0:
+            return [], rest
+
+        loops = self.edge_loop[selected]
+        positions = self.edge_position[selected]
+        order = np.lexsort((positions, loops))
+        selected, loops, positions = selected[order], loops[order], positions[order]
+
+        breaks = np.flatnonzero((np.diff(loops) != 0) | (np.diff(positions) != 1)) + 1
+        starts = np.concatenate(([0], breaks)).tolist()
+        stops = np.concatenate((breaks, [len(selected)])).tolist()
+
+        selected = selected.tolist()
+        loops = loops.tolist()
+        positions = positions.tolist()
+        sizes = self.loop_edge_counts()
+
+        runs = []
+        first_runs = {}
+        for start, stop in zip(starts, stops):
+            loop = loops[start]
+            run = selected[start:stop]
+            if loop not in first_runs:
+                first_runs[loop] = (len(runs), positions[start])
+            else:
+                # the last run through the end of a cyclic loop goes on with the first one
+                first, first_position = first_runs[loop]
+                if self.loop_cyclic[loop] and first_position == 0 and positions[stop - 1] == sizes[loop] - 1:
+                    runs[first] = run + runs[first]
+                    continue
+            runs.append(run)
+
+        regular = []
+        for run in runs:
+            if self.irregular[run].any():
+                rest.extend(run)
+            else:
+                regular.append(run)
+
+        if not rest or not regular:
+            return regular, rest
+
+        # selected edges joined through shared verts, the groups with a walked edge are walked completely
+        all_edges = np.array(rest + [e for run in regular for e in run], dtype=np.int64)
+        verts, local = np.unique(self.edge_verts[all_edges], return_inverse=True)
+        local = local.reshape(-1, 2)
+        labels = components(len(verts), local)[local[:, 0]]
+        walked = set(labels[:len(rest)].tolist())
+
+        kept = []
+        position = len(rest)
+        for run in regular:
+            if labels[position] in walked:
+                rest.extend(run)
+            else:
+                kept.append(run)
+            position += len(run)
+
+        return kept, rest
+
+
+def components(count, pairs):
+    '''
+    Connected components of count items linked by pairs, labelled by their smallest item.
+    Roots are hooked to the smaller root of every pair, then all labels jump to their roots, until no pair is split.
+    '''
+    labels = np.arange(count, dtype=np.int64)
+    if len(pairs) == 0:
+        return labels
+
+    a, b = pairs[:, 0], pairs[:, 1]
+    while True:
+        la, lb = labels[a], labels[b]
+        split = la != lb
+        if not split.any():
+            break
+
+        low = np.minimum(la[split], lb[split])
+        high = np.maximum(la[split], lb[split])
+        np.minimum.at(labels, high, low)
+
+        while True:
+            jumped = labels[labels]
+            if (jumped == labels).all():
+                break
+            labels = jumped
+
+    return labels
+
+
+def edge_record(e):
+    '''
+    What the index keeps of an edge: its vert indices, whether util.get_edgeloop would walk it as an edge loop,
+    the edge util.walk_edge_loop steps to through each vert (-1 if none) and if more than two faces share it.
+    '''
+    v0, v1 = e.verts
+    valence0 = len(v0.link_edges)
+    valence1 = len(v1.link_edges)
+    link_loops = e.link_loops
+
+    # the same choice util.get_edgeloop makes
+    is_ngon = any(len(loop.face.verts) > 4 for loop in link_loops)
+    quad_flow = valence0 == 4 and valence1 == 4
+    loop_end = (valence0 > 4 and valence1 == 4) or (valence0 == 4 and valence1 > 4)
+    walkable = not e.is_boundary and not (is_ngon and not quad_flow and not loop_end)
+
+    steps = [-1, -1]
+    for loop in link_loops:
+        vert = loop.vert
+        if len(vert.link_edges) == 4:
+            steps[0 if vert == v0 else 1] = loop.link_loop_prev.link_loop_radial_prev.link_loop_prev.edge.index
+
+    return (v0.index, v1.index), walkable, tuple(steps), len(link_loops) > 2
+
+
+def topology_key(bm):
+    return (len(bm.verts), len(bm.edges), len(bm.faces))
+
+
+_indices = {}
+_max_cached_indices = 4
+
+# a new index is only built when at least this part of all edges is selected,
+# below that walking the selection is cheaper than a pass over the whole mesh
+min_selection = 0.25
+
+
+def get_loop_index(obj, bm, edges):
+    '''
+    Returns the loop index of the objects mesh for the selected edges, None if they are better walked.
+    An index is kept across operator calls as long as the element counts match and the selected edges
+    still look the way they were indexed, a new one is only built for large selections.
+    '''
+    key = obj.data.as_pointer()
+    topology = topology_key(bm)
+    bm.verts.index_update()
+    bm.edges.index_update()
+    edge_indices = [e.index for e in edges]
+
+    index = _indices.get(key)
+    if index is not None and index.key == topology and index.is_current(bm, edge_indices):
+        return index
+
+    _indices.pop(key, None)
+    if len(edges) < len(bm.edges) * min_selection:
+        return None
+
+    index = LoopIndex(bm, topology)
+    _indices.pop(key, None)
+    _indices[key] = index
+    while len(_indices) > _max_cached_indices:
+        del _indices[next(iter(_indices))]
+
+    return index
+
+
+def clear_cache():
+    _indices.clear()
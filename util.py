@@ -8,10 +8,11 @@ from . import edgeloop
 
 def walk_boundary(start_edge, limit_to_edges=None):
     edge_loop = set([start_edge])
-    visited = set()
 
+    # only the edges added in the last round can reach new ones
     candidates = [start_edge]
-    while True:
+    while candidates:
+        added = set()
         for candidate in candidates:
             for vert in candidate.verts:
                 if len(vert.link_edges) > 2:  # valence of verts as a blocker
@@ -20,20 +21,25 @@ def walk_boundary(start_edge, limit_to_edges=None):
                             if limit_to_edges != None:
                                 if edge in limit_to_edges:
                                     edge_loop.add(edge)
+                                    added.add(edge)
                             else:
                                 edge_loop.add(edge)
+                                added.add(edge)
 
-            visited.add(candidate)
-
-        candidates = edge_loop - visited
-        if len(visited) == len(edge_loop):
-            break
+        candidates = added
 
     #sorting this mess..
     raw_edge_loop = list(edge_loop)
 
     start_edge = raw_edge_loop[0]
-    raw_edge_loop.remove(start_edge)
+
+    # edges at every vert by position in raw_edge_loop, the walk takes the last one still left
+    vert_edges = {}
+    for position, e in enumerate(raw_edge_loop):
+        for v in e.verts:
+            vert_edges.setdefault(v, []).append(position)
+    left = [True] * len(raw_edge_loop)
+    left[0] = False
 
     sorted_edge_loop = deque()
     sorted_edge_loop.append(start_edge)
@@ -43,14 +49,15 @@ def walk_boundary(start_edge, limit_to_edges=None):
         while True:
 
             edge = None
-            for e in raw_edge_loop:
-                if p in e.verts:
-                    edge = e
+            for position in reversed(vert_edges.get(p, ())):
+                if left[position]:
+                    edge = raw_edge_loop[position]
+                    left[position] = False
+                    break
 
             if edge != None:
                 add(edge)
                 p = edge.other_vert(p)
-                raw_edge_loop.remove(edge)
             else:
                 break
 
@@ -68,6 +75,7 @@ def walk_boundary(start_edge, limit_to_edges=None):
 def walk_ngon(start_edge, limit_to_edges=None):
     edge_loop = deque()
     edge_loop.append(start_edge)
+    walked = {start_edge}
 
     start_loops = []
     face_valence = []
@@ -83,21 +91,23 @@ def walk_ngon(start_edge, limit_to_edges=None):
     # print(start_loop.vert.index, start_loop.edge.index)
 
     loop = start_loop.link_loop_next
-    while len(loop.vert.link_edges) < 4 and loop.edge not in edge_loop:
+    while len(loop.vert.link_edges) < 4 and loop.edge not in walked:
         if limit_to_edges != None and loop.edge not in limit_to_edges:
             break
 
         edge_loop.append(loop.edge)
+        walked.add(loop.edge)
         # print("next", loop.edge.index)
         loop = loop.link_loop_next
 
     # print("switch")
     loop = start_loop.link_loop_prev
-    while len(loop.edge.other_vert(loop.vert).link_edges) < 4 and loop.edge not in edge_loop:
+    while len(loop.edge.other_vert(loop.vert).link_edges) < 4 and loop.edge not in walked:
         if limit_to_edges != None and loop.edge not in limit_to_edges:
             break
 
         edge_loop.appendleft(loop.edge)
+        walked.add(loop.edge)
         loop = loop.link_loop_prev
         # print("prev", loop.edge.index)
 
@@ -108,6 +118,7 @@ def walk_edge_loop(start_edge, limit_to_edges=None):
     edge_loop = deque()
     edge_loop.append(start_edge)
     add = edge_loop.append
+    walked = {start_edge}
 
     for loop in start_edge.link_loops:
         start_valence = len(loop.vert.link_edges)
@@ -121,16 +132,18 @@ def walk_edge_loop(start_edge, limit_to_edges=None):
                 if valence == 4 and start_valence == valence:
                     loop = loop.link_loop_prev.link_loop_radial_prev.link_loop_prev
 
-                    if loop.edge in edge_loop:
+                    if loop.edge in walked:
                         break
 
                     if limit_to_edges != None:
                         if loop.edge in limit_to_edges:
                             add(loop.edge)
+                            walked.add(loop.edge)
                         else:
                             break
                     else:
                         add(loop.edge)
+                        walked.add(loop.edge)
 
                         # print("add edge:", loop.edge.index)
                 else:
@@ -144,6 +157,49 @@ def walk_edge_loop(start_edge, limit_to_edges=None):
     return list(edge_loop)
 
 
+def walk_vert_loop(start_vert, target_vert, use_topology_distance=False):
+    '''
+    Follows the edge loops leaving start_vert across valence 4 verts, like walk_edge_loop does.
+    Returns the verts of the shortest walk which reaches target_vert, None if no edge loop connects both.
+    '''
+    best = None
+    best_length = 0
+
+    for edge in start_vert.link_edges:
+        corner = None
+        for loop in edge.link_loops:
+            if loop.vert != start_vert:
+                corner = loop
+                break
+
+        verts = [start_vert]
+        visited = set(verts)
+        length = 0
+        while corner is not None:
+            vert = corner.vert
+            if vert in visited:
+                break
+            visited.add(vert)
+            verts.append(vert)
+            length += 1 if use_topology_distance else corner.edge.calc_length()
+
+            if vert == target_vert:
+                if best is None or length < best_length:
+                    best = verts
+                    best_length = length
+                break
+
+            rung = corner.link_loop_prev
+            if len(vert.link_edges) != 4 or rung.edge.is_boundary:
+                break
+
+            corner = rung.link_loop_radial_prev.link_loop_prev
+            if len(rung.face.verts) != 4 or len(corner.face.verts) != 4:
+                break
+
+    return best
+
+
 def get_edgeloop(bm, start_edge, limit_to_edges=None):
     start_loops = start_edge.link_loops
 
@@ -168,7 +224,7 @@ def get_edgeloop(bm, start_edge, limit_to_edges=None):
         return edgeloop.Loop(bm, walk_edge_loop(start_edge, limit_to_edges))
 
 
-def get_edgeloops(bm, edges):
+def get_edgeloops(bm, edges, index=None):
     '''
     edge_loop = get_edgeloop(edges[0])
 
@@ -181,6 +237,13 @@ def get_edgeloops(bm, edges):
     not_visited = set(edges)
 
     edge_loops = []
+    if index is not None:
+        # runs along the indexed loops are looked up, only the rest is walked
+        bm.edges.ensure_lookup_table()
+        runs, rest = index.selection_runs([e.index for e in edges])
+        edge_loops = [edgeloop.Loop(bm, [bm.edges[i] for i in run]) for run in runs]
+        not_visited = set(bm.edges[i] for i in rest)
+
     while (len(not_visited) > 0):
         next = not_visited.pop()
 
@@ -269,28 +332,90 @@ def find_control_edgeloop(edgeloops, edge_to_Edgeloop):
             #edgeloop.edge_rings[ring] = edge_ring
 
 
-def compute_edge_ring_valences(edgeloops, edge_to_Edgeloop):
+def find_ring_components(edgeloops, edge_to_Edgeloop):
+    '''
+    Labels the edges of the rings built by find_edge_ring_neighbours with one search over all of them.
+    Returns the component of every edge and per component its size, whether it is a cycle
+    and whether it is a plain path or cycle at all (every edge with at most two ring edges, all of them linked back).
+    '''
+    component = {}
+    sizes = []
+    cyclic = []
+    regular = []
+
     for edgeloop in edgeloops:
-        max_valence = -1
         for edge in edgeloop.edges:
-            valence = 0
-            visited = set()
-            search = set()
-            search.add(edge)
-            while len(search) > 0:
+            if edge in component:
+                continue
+
+            index = len(sizes)
+            component[edge] = index
+            search = [edge]
+            size = 0
+            ends = 0
+            is_regular = True
+            while search:
                 current = search.pop()
-                visited.add(current)
+                size += 1
 
-                loop = edge_to_Edgeloop[current]
-                ring_edges = loop.get_ring(current)
+                ring_edges = edge_to_Edgeloop[current].get_ring(current)
+                if len(ring_edges) < 2:
+                    ends += 1
+                elif len(ring_edges) > 2:
+                    is_regular = False
 
-                add_to_valence = True
                 for ring in ring_edges:
-                    if ring not in visited:
-                        search.add(ring)
-                        if add_to_valence:
-                            valence += 1
-                            add_to_valence = False
+                    if current not in edge_to_Edgeloop[ring].get_ring(ring):
+                        is_regular = False
+                    if ring not in component:
+                        component[ring] = index
+                        search.append(ring)
+
+            sizes.append(size)
+            cyclic.append(ends == 0)
+            regular.append(is_regular)
+
+    return component, sizes, cyclic, regular
+
+
+def flood_ring_valence(edge, edge_to_Edgeloop):
+    valence = 0
+    visited = set()
+    search = set()
+    search.add(edge)
+    while len(search) > 0:
+        current = search.pop()
+        visited.add(current)
+
+        loop = edge_to_Edgeloop[current]
+        ring_edges = loop.get_ring(current)
+
+        add_to_valence = True
+        for ring in ring_edges:
+            if ring not in visited:
+                search.add(ring)
+                if add_to_valence:
+                    valence += 1
+                    add_to_valence = False
+
+    return valence
+
+
+def compute_edge_ring_valences(edgeloops, edge_to_Edgeloop):
+    # the valence counts the ring edges which lead further away from an edge,
+    # on a path that is every edge but the far end, or both ends if the edge is in between, on a cycle all but one
+    component, sizes, cyclic, regular = find_ring_components(edgeloops, edge_to_Edgeloop)
+
+    for edgeloop in edgeloops:
+        max_valence = -1
+        for edge in edgeloop.edges:
+            index = component[edge]
+            if not regular[index]:
+                valence = flood_ring_valence(edge, edge_to_Edgeloop)
+            elif cyclic[index] or len(edgeloop.get_ring(edge)) < 2:
+                valence = sizes[index] - 1
+            else:
+                valence = sizes[index] - 2
 
             edgeloop.valences.append(valence)
             max_valence = max(max_valence, valence)